@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks reproducibles para support_rag.py y el pipeline de frecuencias
+-------------------------------------------------------------------------
+Mide, sin GPU ni red (Ollama simulado en localhost):
+- Indexer.reindex en frío e incremental (pocos archivos modificados).
+- RagAgent.ask: percentiles de latencia (p50/p95/p99).
+- Backends vectoriales Chroma vs NumPy: apertura y búsqueda top-k.
+- node_analyze: MB/s y archivos/s (serial y con --workers).
+- node_llm_refine: archivos/s contra el servidor simulado.
+
+El corpus sintético (SOPs .md y tickets .txt en español) y las respuestas del
+servidor falso son deterministas a partir de --seed; las latencias simuladas
+se configuran con --embed-latency y --token-latency. El resultado se escribe
+en JSON para comparar corridas; con --baseline se marcan regresiones.
+
+Uso típico:
+    python bench_rag.py --sops 200 --tickets 2000 --queries 50 \
+      --out ./out/bench.json --baseline ./out/bench_prev.json
+"""
+
+from __future__ import annotations
+from typing import Any, Callable, Dict, List, Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+# ===========================
+#     OLLAMA SIMULADO
+# ===========================
+
+class FakeOllama:
+    """Servidor HTTP mínimo compatible con la API de Ollama usada por ambos scripts.
+
+    /api/embed devuelve vectores deterministas (semilla = hash del texto);
+    /api/chat y /api/generate devuelven `tokens` palabras deterministas, en
+    streaming NDJSON si el cliente lo pide. Las latencias son configurables.
+    """
+
+    WORDS = ("revisar", "cable", "reiniciar", "pos", "impresora", "red", "switch", "validar",
+             "caja", "boleta", "papel", "pinpad", "conexión", "listo", "paso", "minutos")
+
+    def __init__(self, dim: int = 256, embed_latency: float = 0.0, token_latency: float = 0.0,
+                 tokens: int = 48):
+        self.dim = dim
+        self.embed_latency = embed_latency
+        self.token_latency = token_latency
+        self.tokens = tokens
+        self.calls: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._srv: Optional[ThreadingHTTPServer] = None
+
+    def vector(self, text: str) -> List[float]:
+        rnd = random.Random(hashlib.sha1(text.encode("utf-8")).digest())
+        return [rnd.gauss(0.0, 1.0) for _ in range(self.dim)]
+
+    def answer(self, prompt: str) -> List[str]:
+        rnd = random.Random(hashlib.sha1(prompt.encode("utf-8")).digest())
+        return [rnd.choice(self.WORDS) + " " for _ in range(self.tokens)]
+
+    def _count(self, path: str):
+        with self._lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+
+    def start(self) -> str:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):  # silencioso
+                pass
+
+            def _json(self, obj: Any, code: int = 200):
+                body = json.dumps(obj).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                fake._count(self.path)
+                if self.path.startswith("/api/tags") or self.path.startswith("/api/ps"):
+                    self._json({"models": [{"name": "fake", "model": "fake", "size": 0}]})
+                else:
+                    self._json({"error": "not found"}, 404)
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                fake._count(self.path)
+                n = int(self.headers.get("Content-Length") or 0)
+                req = json.loads(self.rfile.read(n) or b"{}")
+                model = req.get("model", "fake")
+                if self.path == "/api/embed":
+                    inputs = req.get("input", [])
+                    inputs = [inputs] if isinstance(inputs, str) else inputs
+                    time.sleep(fake.embed_latency)
+                    self._json({"model": model, "embeddings": [fake.vector(t) for t in inputs]})
+                elif self.path == "/api/embeddings":
+                    time.sleep(fake.embed_latency)
+                    self._json({"embedding": fake.vector(req.get("prompt", ""))})
+                elif self.path in ("/api/chat", "/api/generate"):
+                    self._generate(req, model, chat=self.path == "/api/chat")
+                elif self.path == "/api/show":
+                    self._json({"modelfile": "", "parameters": "", "template": "", "details": {}, "model_info": {}})
+                else:
+                    self._json({"error": "not found"}, 404)
+
+            def _generate(self, req: Dict[str, Any], model: str, chat: bool):
+                prompt = json.dumps(req.get("messages") or req.get("prompt") or "", ensure_ascii=False)
+                toks = fake.answer(prompt)
+                t0 = time.perf_counter_ns()
+                final = {"model": model, "created_at": "1970-01-01T00:00:00Z", "done": True, "done_reason": "stop",
+                         "prompt_eval_count": len(prompt) // 4, "eval_count": len(toks)}
+
+                def piece(text: str, done: bool = False) -> Dict[str, Any]:
+                    base = {"model": model, "created_at": "1970-01-01T00:00:00Z", "done": done}
+                    if chat:
+                        base["message"] = {"role": "assistant", "content": text}
+                    else:
+                        base["response"] = text
+                    return base
+
+                if not req.get("stream", True):
+                    time.sleep(fake.token_latency * len(toks))
+                    final.update(piece("".join(toks), True), eval_duration=time.perf_counter_ns() - t0)
+                    return self._json({**final, "done_reason": "stop"})
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def send(obj: Dict[str, Any]):
+                    line = (json.dumps(obj) + "\n").encode("utf-8")
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                    self.wfile.flush()
+
+                for t in toks:
+                    time.sleep(fake.token_latency)
+                    send(piece(t))
+                final.update(piece("", True), eval_duration=time.perf_counter_ns() - t0)
+                send(final)
+                self.wfile.write(b"0\r\n\r\n")
+
+        self._srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._srv.daemon_threads = True
+        threading.Thread(target=self._srv.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self._srv.server_address[1]}"
+
+    def stop(self):
+        if self._srv is not None:
+            self._srv.shutdown()
+            self._srv.server_close()
+
+
+# ===========================
+#     CORPUS SINTÉTICO
+# ===========================
+
+AREAS = ["POS", "Impresora", "Red", "Handheld", "Inventario", "Etiquetado", "Pinpad", "Escáner"]
+SINTOMAS = ["no imprime", "sin conexión", "lento", "error al cerrar caja", "no sincroniza",
+            "pantalla en blanco", "código de error", "no lee códigos", "no responde"]
+ACCIONES = ["Verificar que el cable de poder esté firme", "Reiniciar el equipo y esperar 60 segundos",
+            "Revisar el indicador de enlace en el switch", "Cambiar el rollo de papel térmico",
+            "Validar la sincronización con el servidor central", "Limpiar el lector con paño seco",
+            "Confirmar la IP asignada en la configuración", "Probar con otro puerto USB",
+            "Escalar a mesa de ayuda nivel 2 con el número de ticket", "Registrar la hora exacta del incidente"]
+IMPACTOS = ["Caja detenida", "Atención parcial", "Tienda detenida"]
+
+
+def make_corpus(root: Path, sops: int, tickets: int, seed: int, sop_steps: int = 12,
+                ticket_lines: int = 30) -> Dict[str, Path]:
+    """Genera docs/ (SOPs .md por área) y tickets/ (.txt) deterministas."""
+    rnd = random.Random(seed)
+    docs, tks = root / "docs", root / "tickets"
+    for i in range(sops):
+        area = AREAS[i % len(AREAS)]
+        sint = rnd.choice(SINTOMAS)
+        code = f"E-{rnd.randint(100, 9999)}"
+        steps = "\n".join(f"{n}. {rnd.choice(ACCIONES)} ({rnd.randint(1, 3)} min)." for n in range(1, sop_steps + 1))
+        text = (f"# {area}: {sint} ({code})\n\n## Síntomas\nEl equipo {area.lower()} presenta {sint}. "
+                f"Puede aparecer el código {code} en pantalla.\n\n## Pasos\n{steps}\n\n"
+                f"## Validación\nListo si la operación se completa sin el error {code}.\n")
+        p = docs / "sops" / area.lower() / f"sop_{i:05d}.md"
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_text(text, encoding="utf-8")
+    tks.mkdir(parents=True, exist_ok=True)
+    for i in range(tickets):
+        lines = [f"Tienda {rnd.randint(100, 250)} terminal POS-{rnd.randint(1, 40):02d}: "
+                 f"{rnd.choice(AREAS).lower()} {rnd.choice(SINTOMAS)}. {rnd.choice(ACCIONES)}."
+                 for _ in range(ticket_lines)]
+        (tks / f"ticket_{i:06d}.txt").write_text("\n".join(lines), encoding="utf-8")
+    return {"docs": docs, "tickets": tks}
+
+
+def make_queries(n: int, seed: int) -> List[str]:
+    rnd = random.Random(seed + 1)
+    return [f"tienda={rnd.randint(100, 250)} | terminal=POS-{rnd.randint(1, 40):02d} | area={rnd.choice(AREAS)} | "
+            f"sintoma={rnd.choice(SINTOMAS)} | reinicio={rnd.choice(['Si', 'No'])} | impacto={rnd.choice(IMPACTOS)}"
+            for _ in range(n)]
+
+
+# ===========================
+#        MEDICIONES
+# ===========================
+
+def _timed(fn: Callable[[], Any]) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return time.perf_counter() - t0
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    ms = sorted(x * 1000 for x in samples)
+    q = statistics.quantiles(ms, n=100, method="inclusive") if len(ms) > 1 else ms * 99
+    return {"n": len(ms), "mean_ms": statistics.fmean(ms), "p50_ms": q[49], "p95_ms": q[94], "p99_ms": q[98],
+            "max_ms": ms[-1]}
+
+
+def _settings(work: Path, docs: Path, **extra):
+    import support_rag as sr
+    return sr.Settings(DOCS_DIR=docs, CHROMA_DIR=work / "db", STAMP_FILE=work / "db" / "index.stamp",
+                       EMBED_CACHE_DIR=work / "emb_cache", **extra)
+
+
+def bench_index(work: Path, docs: Path, changed: int, seed: int, **extra) -> Dict[str, Any]:
+    import support_rag as sr
+    # con --work reutilizado quedarían el manifiesto y la cache de embeddings: el "frío" no indexaría nada
+    shutil.rmtree(work, ignore_errors=True)
+    s = _settings(work, docs, **extra)
+    idx = sr.Indexer(s)
+    cold = _timed(idx.reindex)
+    chunks = sum(len(e["ids"]) for e in idx.read_manifest().values())
+    rnd = random.Random(seed + 2)
+    files = sorted(docs.rglob("*.md"))
+    for p in rnd.sample(files, min(changed, len(files))):
+        p.write_text(p.read_text(encoding="utf-8") + f"\nNota de revisión {rnd.random():.6f}.\n", encoding="utf-8")
+    incr = _timed(idx.reindex)
+    noop = _timed(idx.ensure_index)
+    return {"files": len(files), "chunks": chunks, "cold_s": cold, "cold_chunks_per_s": chunks / cold if cold else 0.0,
+            "incremental_files": min(changed, len(files)), "incremental_s": incr, "noop_check_s": noop}
+
+
+def bench_ask(work: Path, docs: Path, queries: List[str], **extra) -> Dict[str, Any]:
+    import support_rag as sr
+    agent = sr.RagAgent(_settings(work, docs, **extra))
+    agent.ask(queries[0])  # calentamiento: compila grafo y abre store
+    lat = [_timed(lambda q=q: agent.ask(q)) for q in queries]
+    ttft = []
+    for q in queries[: max(1, len(queries) // 5)]:
+        t0 = time.perf_counter()
+        for kind, _ in agent.stream(q + " (stream)"):
+            if kind == "token":
+                ttft.append(time.perf_counter() - t0)
+                break
+    return {**_percentiles(lat), "ttft": _percentiles(ttft) if ttft else {}}
+
+
+def bench_vectors(work: Path, docs: Path, queries: List[str], k: int = 4) -> Dict[str, Any]:
+    """Apertura y búsqueda top-k con vectores ya calculados (sin costo de embedding)."""
+    import support_rag as sr
+    out: Dict[str, Any] = {}
+    for backend in ("chroma", "numpy"):
+        if backend == "numpy" and sr.np is None:
+            out[backend] = {"skipped": "numpy no instalado"}
+            continue
+        wdir = work / f"vec_{backend}"
+        s = _settings(wdir, docs, VECTOR_BACKEND=backend)
+        emb = sr.make_embeddings(s)
+        sr.Indexer(s, emb).reindex()
+        vecs = emb.embed_documents(queries)
+        t0 = time.perf_counter()
+        vs = sr.open_vector_store(s, emb)
+        vs.similarity_search_by_vector(vecs[0], k=k)
+        open_s = time.perf_counter() - t0
+        lat = [_timed(lambda v=v: vs.similarity_search_by_vector(v, k=k)) for v in vecs]
+        res = {"open_first_query_s": open_s, **_percentiles(lat)}
+        if backend == "numpy":
+            res["batch_all_queries_s"] = _timed(lambda: vs.similarity_search_by_vectors(vecs, k=k))
+        out[backend] = res
+    return out
+
+
+def _pipeline_state(tickets: Path, out: Path, **extra) -> Dict[str, Any]:
+    st = {
+        "input_dir": str(tickets), "out_dir": str(out), "top_n": 8, "exts": [".txt"], "recursive": False,
+        "autofill": False, "min_chars_llm": 200, "workers": 1, "files": [], "records": [],
+        "global_top": [], "llm_enabled": True, "llm_model": "fake", "llm_temperature": 0.2, "llm_workers": 4,
+        "llm_timeout": 60.0, "llm_retries": 0, "cache_path": "", "cache_stats": {}, "report_stats": {},
+        "report_path": "", "summary_path": "", "warnings": [],
+    }
+    st.update(extra)
+    return st
+
+
+def bench_pipeline(tickets: Path, out: Path, workers: int, llm_workers: int, llm_files: int) -> Dict[str, Any]:
+    import langgraph_ollama_gemma3_pipeline as fp
+    total_bytes = sum(p.stat().st_size for p in tickets.glob("*.txt"))
+    res: Dict[str, Any] = {"bytes": total_bytes}
+    for w in sorted({1, workers}):
+        st = fp.node_ingest(_pipeline_state(tickets, out, workers=w))
+        el = _timed(lambda: fp.node_analyze(st))
+        res[f"analyze_workers_{w}"] = {"s": el, "mb_per_s": total_bytes / 1e6 / el, "files_per_s": len(st["files"]) / el}
+    st = fp.node_analyze(fp.node_ingest(_pipeline_state(tickets, out, llm_workers=llm_workers)))
+    st["records"] = st["records"][:llm_files]
+    el = _timed(lambda: fp.node_llm_refine(st))
+    res["llm_refine"] = {"files": len(st["records"]), "workers": llm_workers, "s": el,
+                         "files_per_s": len(st["records"]) / el, "warnings": len(st["warnings"])}
+    return res
+
+
+# ===========================
+#       COMPARACIÓN
+# ===========================
+
+def _flatten(d: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for k, v in d.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            out.update(_flatten(v, key + "."))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[key] = float(v)
+    return out
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Regresiones: tiempos (_s/_ms) que suben o tasas (_per_s) que bajan más que `tolerance`."""
+    cur, base = _flatten(current["results"]), _flatten(baseline.get("results", {}))
+    found = []
+    for k, v in cur.items():
+        b = base.get(k)
+        if not b:
+            continue
+        if k.endswith("_per_s") and v < b * (1 - tolerance):
+            found.append(f"{k}: {b:.3f} -> {v:.3f}")
+        elif (k.endswith("_s") or k.endswith("_ms")) and not k.endswith("_per_s") and v > b * (1 + tolerance):
+            found.append(f"{k}: {b:.3f} -> {v:.3f}")
+    return found
+
+
+# ===========================
+#            CLI
+# ===========================
+
+def parse_args() -> argparse.Namespace:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sops", type=int, default=120, help="SOPs sintéticos a generar.")
+    ap.add_argument("--tickets", type=int, default=1000, help="Tickets sintéticos para el pipeline de frecuencias.")
+    ap.add_argument("--queries", type=int, default=40, help="Preguntas para medir RagAgent.ask.")
+    ap.add_argument("--changed", type=int, default=3, help="SOPs modificados para el reindex incremental.")
+    ap.add_argument("--workers", type=int, default=4, help="Procesos para node_analyze.")
+    ap.add_argument("--llm-workers", type=int, default=4, dest="llm_workers", help="Concurrencia de node_llm_refine.")
+    ap.add_argument("--llm-files", type=int, default=100, dest="llm_files", help="Archivos a resumir en node_llm_refine.")
+    ap.add_argument("--embed-latency", type=float, default=0.01, dest="embed_latency", help="Latencia simulada por petición de embedding (s).")
+    ap.add_argument("--token-latency", type=float, default=0.002, dest="token_latency", help="Latencia simulada por token (s).")
+    ap.add_argument("--tokens", type=int, default=48, help="Tokens por respuesta simulada.")
+    ap.add_argument("--dim", type=int, default=256, help="Dimensión de los embeddings simulados.")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--work", default="", help="Directorio de trabajo (por defecto, uno temporal).")
+    ap.add_argument("--out", default="./out/bench.json", help="Archivo JSON de resultados.")
+    ap.add_argument("--baseline", default="", help="JSON de una corrida previa para detectar regresiones.")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="Tolerancia relativa para regresiones.")
+    return ap.parse_args()
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, timeout=5).stdout.strip()
+    except Exception:
+        return ""
+
+
+def main():
+    args = parse_args()
+    fake = FakeOllama(dim=args.dim, embed_latency=args.embed_latency, token_latency=args.token_latency,
+                      tokens=args.tokens)
+    # Debe fijarse antes de importar los scripts: ollama crea su cliente por defecto al importarse
+    os.environ["OLLAMA_HOST"] = fake.start()
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+    work = Path(args.work) if args.work else Path(tempfile.mkdtemp(prefix="bench_rag_"))
+    corpus = make_corpus(work, args.sops, args.tickets, args.seed)
+    queries = make_queries(args.queries, args.seed)
+
+    results: Dict[str, Any] = {}
+    results["index"] = bench_index(work / "rag", corpus["docs"], args.changed, args.seed)
+    results["ask"] = bench_ask(work / "rag", corpus["docs"], queries, ANSWER_CACHE_MAX=0)
+    results["vector_backends"] = bench_vectors(work, corpus["docs"], queries)
+    results["pipeline"] = bench_pipeline(corpus["tickets"], work / "out", args.workers, args.llm_workers,
+                                         args.llm_files)
+    fake.stop()
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "params": vars(args),
+            "fake_ollama_calls": fake.calls,
+        },
+        "results": results,
+    }
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print("[OK] Benchmark:", out)
+
+    if args.baseline:
+        regressions = compare(report, json.loads(Path(args.baseline).read_text(encoding="utf-8")), args.tolerance)
+        if regressions:
+            print("Regresiones:")
+            for r in regressions:
+                print(" -", r)
+            sys.exit(1)
+        print("[OK] Sin regresiones respecto a", args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,18 @@ Características:
 - Análisis determinista (frecuencia de términos) + (opcional) resumen LLM por archivo.
 - Nodo LLM usa Ollama local con gemma3:1b (si está instalado y corriendo).
 - Umbral --min-chars para invocar LLM solo en textos lo suficientemente grandes.
+- Análisis en streaming (memoria plana) y paralelo opcional con --workers N.
+- Conteo con vocabulario compartido y vectores dispersos (top-N con NumPy si está instalado)
+  + palabras clave TF-IDF por archivo.
+- Salida incremental: files.jsonl y report.md se escriben archivo por archivo apenas hay
+  resumen; summary.json se arma con agregados. Una corrida cortada deja resultados parciales.
+  La memoria no es constante: TF-IDF necesita el corpus completo antes de escribir, así que
+  crece con la cantidad de archivos (un DocRecord liviano cada uno), no con su texto.
+- Resúmenes LLM concurrentes (--llm-workers) con timeout y reintentos con backoff.
+- Cache persistente por archivo (SQLite en --out): solo se procesan archivos nuevos o modificados.
+- --metrics: tiempos por nodo y tokens/s de Ollama (logs JSON + sección "timing" en summary.json).
+- Cliente Ollama compartido (ollama_client.py): una petición de carga verifica y precarga el modelo con
+  --keep-alive; si falla varias veces seguidas se dejan de encolar resúmenes.
 
 Instalación:
     pip install langgraph
@@ -20,7 +32,7 @@ Uso típico:
     python langgraph_ollama_gemma3_pipeline.py \
       --input ./docs --out ./out --top 8 \
       --ext .txt,.md --recursive true --autofill true \
-      --ollama --model gemma3:1b --temp 0.2 --min-chars 200
+      --ollama --model gemma3:1b --temp 0.2 --min-chars 200 --workers 4
 
 Flags útiles:
     --ollama       habilita nodo LLM (booleano)
@@ -28,22 +40,29 @@ Flags útiles:
 """
 
 from __future__ import annotations
-from typing import TypedDict, Dict, List, Tuple, Optional
-from collections import Counter
+from typing import TypedDict, Dict, List, Tuple, Optional, Any, Union
+from array import array
+from collections import Counter, deque
 from pathlib import Path
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 import argparse
+import hashlib
+import heapq
+import math
+import os
 import re
+import sqlite3
 import json
 import time
 
-from langgraph.graph import StateGraph, END
+from metrics import METRICS, enable_logging
+from ollama_client import OLLAMA, parse_keep_alive
 
-# ---- Cliente Ollama (opcional) ----
 try:
-    import ollama
-    _OLLAMA_AVAILABLE = True
-except Exception:
-    _OLLAMA_AVAILABLE = False
+    import numpy as np  # opcional: top-N vectorizado en TermIndex
+except ImportError:
+    np = None
+
 
 
 # ===========================
@@ -59,14 +78,21 @@ class PipelineState(TypedDict):
     recursive: bool
     autofill: bool
     min_chars_llm: int
-    # Datos y resultados
+    workers: int
+    # Datos y resultados (top y palabras clave por archivo viven en cada DocRecord)
     files: List[str]
-    counts: Dict[str, List[Tuple[str, int]]]
+    records: List["DocRecord"]
     global_top: List[Tuple[str, int]]
+    vocab_size: int
     llm_enabled: bool
     llm_model: str
     llm_temperature: float
-    llm_summaries: Dict[str, str]
+    llm_workers: int
+    llm_timeout: float
+    llm_retries: int
+    cache_path: str
+    cache_stats: Dict[str, int]
+    report_stats: Dict[str, Any]
     report_path: str
     summary_path: str
     warnings: List[str]
@@ -96,6 +122,276 @@ def tokenize(text: str) -> List[str]:
 def filter_tokens(tokens: List[str]) -> List[str]:
     return [t for t in tokens if t not in STOP and len(t) > 2]
 
+READ_CHUNK = 1 << 20  # caracteres por lectura en el análisis en streaming
+EXCERPT_CHARS = 1200  # tamaño del extracto enviado al LLM
+_TAIL_RE = re.compile(TOKEN_RE.pattern + r"\Z", re.UNICODE)
+
+
+class DocRecord:
+    """Registro compacto de un archivo de entrada.
+
+    node_ingest llena path/size/mtime con un solo stat; node_analyze completa
+    chars, excerpt, top y keywords en la misma pasada de lectura que cuenta
+    términos. El texto completo nunca queda en el estado.
+    """
+    __slots__ = ("path", "name", "size", "mtime", "chars", "excerpt", "sha", "top", "keywords")
+
+    def __init__(self, path: str, size: int, mtime: float):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.size = size
+        self.mtime = mtime
+        self.chars = -1
+        self.excerpt = ""
+        self.sha = ""
+        self.top: List[Tuple[str, int]] = []
+        self.keywords: List[Tuple[str, float]] = []
+
+    def __repr__(self) -> str:
+        return f"DocRecord({self.path!r}, size={self.size}, chars={self.chars})"
+
+
+def make_excerpt(head: str, eof: bool) -> str:
+    """Extracto de EXCERPT_CHARS sobre el texto normalizado; `head` es un prefijo del archivo."""
+    text = head.strip() if eof else head.lstrip()
+    excerpt = text.replace("\n", " ")
+    if len(excerpt) > EXCERPT_CHARS:
+        excerpt = excerpt[:EXCERPT_CHARS] + "…"
+    return excerpt
+
+
+def scan_file(fp: str, chunk_chars: int = READ_CHUNK) -> Tuple[Counter, int, str, str]:
+    """Lee el archivo una sola vez por bloques y devuelve (conteo de términos,
+    largo en caracteres, extracto, hash del contenido). Un token cortado al final de un bloque se
+    arrastra al siguiente, así el conteo es idéntico a
+    Counter(filter_tokens(tokenize(texto_completo)))."""
+    cnt: Counter = Counter()
+    carry, head, nchars, need_head = "", "", 0, True
+    digest = hashlib.sha1()
+    with open(fp, encoding="utf-8", errors="ignore") as fh:
+        while True:
+            block = fh.read(chunk_chars)
+            if not block:
+                break
+            nchars += len(block)
+            digest.update(block.encode("utf-8"))
+            if need_head:
+                head += block
+                need_head = len(head.strip()) <= EXCERPT_CHARS
+            buf = carry + block.lower()
+            m = _TAIL_RE.search(buf)
+            carry, buf = (buf[m.start():], buf[:m.start()]) if m else ("", buf)
+            cnt.update(t for t in TOKEN_RE.findall(buf) if t not in STOP and len(t) > 2)
+    if carry:
+        cnt.update(t for t in TOKEN_RE.findall(carry) if t not in STOP and len(t) > 2)
+    return cnt, nchars, make_excerpt(head, need_head), digest.hexdigest()
+
+
+def _top_idx(values, n: int) -> List[int]:
+    """Índices de los n mayores valores; empates en orden de índice (como most_common)."""
+    size = len(values)
+    if n <= 0 or not size:
+        return []
+    if np is None:
+        return heapq.nsmallest(n, range(size), key=lambda j: -values[j])
+    v = np.asarray(values)
+    if n < size:
+        cand = np.flatnonzero(v >= np.partition(v, size - n)[size - n])
+    else:
+        cand = np.arange(size)
+    return cand[np.argsort(-v[cand], kind="stable")][:n].tolist()
+
+
+class TermIndex:
+    """Vocabulario compartido + conteos dispersos por archivo.
+
+    Cada término distinto se guarda una sola vez (str -> id). Un archivo es un
+    par de arreglos compactos (ids, frecuencias) en orden de primera aparición
+    en el archivo; los ids siguen el orden de primera aparición en el corpus.
+    Con eso los desempates del top por archivo y del top global coinciden con
+    Counter.most_common. Con NumPy las agregaciones son vectorizadas.
+    """
+
+    def __init__(self):
+        self.vocab: Dict[str, int] = {}
+        self.terms: List[str] = []
+        self.ids: List[array] = []
+        self.freqs: List[array] = []
+        self.lengths: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, cnt: Counter) -> int:
+        """Interna los términos de un archivo y devuelve su posición."""
+        vocab, terms = self.vocab, self.terms
+        ids = array("i")
+        for t in cnt:
+            i = vocab.get(t)
+            if i is None:
+                i = vocab[t] = len(terms)
+                terms.append(t)
+            ids.append(i)
+        freqs = array("q", cnt.values())
+        self.ids.append(ids)
+        self.freqs.append(freqs)
+        self.lengths.append(sum(freqs))
+        return len(self.ids) - 1
+
+    def top(self, doc: int, n: int) -> List[Tuple[str, int]]:
+        ids, freqs = self.ids[doc], self.freqs[doc]
+        return [(self.terms[ids[j]], freqs[j]) for j in _top_idx(freqs, n)]
+
+    def _totals(self, df: bool = False):
+        """Frecuencia global por id (o frecuencia documental con df=True)."""
+        size = len(self.terms)
+        if np is not None:
+            if not self.ids:
+                return np.zeros(size, dtype=np.int64)
+            ids = np.concatenate([np.frombuffer(a, dtype=np.int32) for a in self.ids])
+            weights = None if df else np.concatenate([np.frombuffer(a, dtype=np.int64) for a in self.freqs])
+            return np.bincount(ids, weights=weights, minlength=size).astype(np.int64)
+        out = [0] * size
+        for ids, freqs in zip(self.ids, self.freqs):
+            for i, f in zip(ids, freqs):
+                out[i] += 1 if df else f
+        return out
+
+    def global_top(self, n: int) -> List[Tuple[str, int]]:
+        totals = self._totals()
+        return [(self.terms[i], int(totals[i])) for i in _top_idx(totals, n)]
+
+    def keywords(self, n: int) -> List[List[Tuple[str, float]]]:
+        """Top-n TF-IDF por archivo: tf = frec/tokens del archivo, idf suavizado ln((1+N)/(1+df)) + 1."""
+        ndocs = len(self.ids)
+        df = self._totals(df=True)
+        out: List[List[Tuple[str, float]]] = []
+        if np is not None:
+            idf = np.log((1 + ndocs) / (1 + df.astype(np.float64))) + 1.0
+        else:
+            idf = [math.log((1 + ndocs) / (1 + d)) + 1.0 for d in df]
+        for ids, freqs, length in zip(self.ids, self.freqs, self.lengths):
+            if not length:
+                out.append([])
+                continue
+            if np is not None:
+                scores = np.frombuffer(freqs, dtype=np.int64) / length * idf[np.frombuffer(ids, dtype=np.int32)]
+            else:
+                scores = [f / length * idf[i] for i, f in zip(ids, freqs)]
+            out.append([(self.terms[ids[j]], round(float(scores[j]), 6)) for j in _top_idx(scores, n)])
+        return out
+
+PROMPT_VERSION = "1"  # incrementar al cambiar _build_prompt: invalida los resúmenes cacheados
+
+
+class ResultCache:
+    """Cache persistente por archivo en SQLite.
+
+    analysis: conteo completo (pares en orden de inserción, para desempates
+    idénticos), largo y extracto, validados por size+mtime y con hash de contenido.
+    summaries: resumen LLM por (ruta, hash, top_n, modelo, temperatura, versión de prompt).
+    """
+
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS analysis (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, "
+            "sha TEXT, chars INTEGER, excerpt TEXT, counts TEXT);"
+            "CREATE TABLE IF NOT EXISTS summaries (path TEXT, sha TEXT, top_n INTEGER, model TEXT, "
+            "temperature REAL, prompt_version TEXT, summary TEXT, "
+            "PRIMARY KEY (path, sha, top_n, model, temperature, prompt_version));"
+        )
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def get_analysis(self, rec: DocRecord) -> Optional[Tuple[Counter, int, str, str]]:
+        row = self.db.execute(
+            "SELECT counts, chars, excerpt, sha FROM analysis WHERE path=? AND size=? AND mtime=?",
+            (rec.path, rec.size, rec.mtime),
+        ).fetchone()
+        if row is None:
+            return None
+        return Counter(dict(json.loads(row[0]))), row[1], row[2], row[3]
+
+    def put_analysis(self, rec: DocRecord, cnt: Counter):
+        self.db.execute(
+            "INSERT OR REPLACE INTO analysis VALUES (?,?,?,?,?,?,?)",
+            (rec.path, rec.size, rec.mtime, rec.sha, rec.chars, rec.excerpt,
+             json.dumps(list(cnt.items()), ensure_ascii=False)),
+        )
+        self.db.execute("DELETE FROM summaries WHERE path=? AND sha<>?", (rec.path, rec.sha))
+
+    def evict_missing(self, keep: set) -> int:
+        gone = [(p,) for (p,) in self.db.execute("SELECT path FROM analysis")
+                if p not in keep and not os.path.exists(p)]
+        self.db.executemany("DELETE FROM analysis WHERE path=?", gone)
+        self.db.executemany("DELETE FROM summaries WHERE path=?", gone)
+        return len(gone)
+
+    def get_summary(self, rec: DocRecord, top_n: int, model: str, temperature: float) -> Optional[str]:
+        row = self.db.execute(
+            "SELECT summary FROM summaries WHERE path=? AND sha=? AND top_n=? AND model=? "
+            "AND temperature=? AND prompt_version=?",
+            (rec.path, rec.sha, top_n, model, temperature, PROMPT_VERSION),
+        ).fetchone()
+        return row[0] if row else None
+
+    def put_summary(self, rec: DocRecord, top_n: int, model: str, temperature: float, summary: str):
+        self.db.execute(
+            "INSERT OR REPLACE INTO summaries VALUES (?,?,?,?,?,?,?)",
+            (rec.path, rec.sha, top_n, model, temperature, PROMPT_VERSION, summary),
+        )
+
+
+class ReportWriter:
+    """Escritura incremental de resultados por archivo.
+
+    files.jsonl (append-only) y report.md reciben cada archivo apenas está
+    completo; add() libera el extracto, el top y las palabras clave del
+    DocRecord, que queda solo con ruta, tamaño y hash. summary.json lo arma
+    node_compile_report a partir de close(), sin releer los resultados.
+    """
+
+    def __init__(self, out_dir: Path, warnings: List[str]):
+        out_dir.mkdir(parents=True, exist_ok=True)
+        self.md = open(out_dir / "report.md", "w", encoding="utf-8")
+        self.jsonl = open(out_dir / "files.jsonl", "w", encoding="utf-8")
+        self.names: List[str] = []
+        self.top_terms: set = set()
+        self.chars = 0
+        self.warnings_written = len(warnings)
+        self.md.write("# Reporte de Frecuencia de Términos\n\n")
+        if warnings:
+            self.md.write("> **Avisos**:\n" + "".join(f"> - {w}\n" for w in warnings) + "\n")
+
+    def add(self, rec: DocRecord, summary: Optional[str] = None):
+        md = [f"## {rec.name}\n", "| Término | Frecuencia |", "|---|---:|"]
+        md += [f"| {term} | {freq} |" for term, freq in rec.top]
+        md.append("")
+        if rec.keywords:
+            md += ["**Palabras clave (TF-IDF):** " + ", ".join(t for t, _ in rec.keywords), ""]
+        if summary:
+            md += ["**Resumen LLM (gemma3:1b):**", summary, ""]
+        self.md.write("\n".join(md) + "\n")
+        self.jsonl.write(json.dumps({"file": rec.name, "path": rec.path, "chars": rec.chars, "top": rec.top,
+                                     "keywords": rec.keywords, "summary": summary}, ensure_ascii=False) + "\n")
+        self.md.flush()
+        self.jsonl.flush()
+        self.names.append(rec.name)
+        self.top_terms.update(t for t, _ in rec.top)
+        self.chars += max(rec.chars, 0)
+        rec.excerpt, rec.top, rec.keywords = "", [], []
+
+    def close(self) -> Dict[str, Any]:
+        self.md.close()
+        self.jsonl.close()
+        return {"archivos": self.names, "unique_top_terms": len(self.top_terms), "chars": self.chars,
+                "warnings_written": self.warnings_written}
+
+
 def ensure_demo_data(path: Path):
     """Crea 2 documentos de ejemplo si la carpeta está vacía."""
     path.mkdir(parents=True, exist_ok=True)
@@ -131,69 +427,93 @@ def node_ingest(state: PipelineState) -> PipelineState:
     if not in_dir.exists():
         in_dir.mkdir(parents=True, exist_ok=True)
 
-    def match(p: Path) -> bool:
-        return p.is_file() and p.suffix.lower() in exts
-
-    files: List[Path]
-    if recursive:
-        files = sorted([p for p in in_dir.rglob("*") if match(p)])
-    else:
-        files = sorted([p for p in in_dir.glob("*") if match(p)])
-
-    if not files and autofill:
+    def scan(root: str) -> List[DocRecord]:
+        # os.scandir reutiliza el tipo de entrada del directorio: un solo stat por archivo aceptado
+        found: List[DocRecord] = []
+        with os.scandir(root) as it:
+            for e in it:
+                if e.is_dir(follow_symlinks=False):
+                    if recursive:
+                        found.extend(scan(e.path))
+                elif os.path.splitext(e.name)[1].lower() in exts and e.is_file():
+                    st = e.stat()
+                    found.append(DocRecord(e.path, st.st_size, st.st_mtime))
+        return found
+
+    records = sorted(scan(str(in_dir)), key=lambda r: Path(r.path))
+
+    if not records and autofill:
         ensure_demo_data(in_dir)
-        if recursive:
-            files = sorted([p for p in in_dir.rglob("*") if match(p)])
-        else:
-            files = sorted([p for p in in_dir.glob("*") if match(p)])
+        records = sorted(scan(str(in_dir)), key=lambda r: Path(r.path))
 
-    if not files:
+    if not records:
         raise RuntimeError(
             f"No se encontraron archivos con extensiones {exts} en {in_dir} "
             f"(recursive={recursive}). Crea .txt/.md o usa --autofill."
         )
 
-    state["files"] = [str(p) for p in files]
+    state["records"] = records
+    state["files"] = [r.path for r in records]
     return state
 
 
 def node_analyze(state: PipelineState) -> PipelineState:
-    """Tokeniza, filtra stopwords y calcula top-N por archivo + top global."""
-    top_n = state["top_n"]
-    results: Dict[str, List[Tuple[str, int]]] = {}
-    global_counter = Counter()
-
-    for fp in state["files"]:
-        text = Path(fp).read_text(encoding="utf-8", errors="ignore")
-        tokens = filter_tokens(tokenize(text))
-        cnt = Counter(tokens)
-        results[Path(fp).name] = cnt.most_common(top_n)
-        global_counter.update(cnt)
-
-    state["counts"] = results
-    state["global_top"] = global_counter.most_common(top_n)
-    return state
+    """Tokeniza, filtra stopwords y calcula top-N por archivo, top global y
+    palabras clave TF-IDF.
 
-
-def _ollama_ready(model: str) -> Tuple[bool, Optional[str]]:
-    """Verifica que el cliente/daemon/modelo de Ollama esté listo."""
-    if not _OLLAMA_AVAILABLE:
-        return False, "Paquete 'ollama' no está instalado (pip install ollama)."
-    try:
-        _ = ollama.list()  # comprueba daemon
-    except Exception as e:
-        return False, f"Ollama no responde: {e}. Asegura que el daemon esté corriendo."
+    Con workers > 1 reparte los archivos en un pool de procesos; los conteos
+    se internan en un TermIndex en el orden de `files`, por lo que la salida es
+    la misma que en modo serial (incluido el desempate de most_common)."""
+    top_n = state["top_n"]
+    records = state["records"]
+    workers = max(1, int(state.get("workers", 1)))
+    index = TermIndex()
+
+    # Con cache, solo se leen los archivos nuevos o modificados (size/mtime distintos)
+    cache = ResultCache(state["cache_path"]) if state.get("cache_path") else None
+    cached: Dict[int, Tuple[Counter, int, str, str]] = {}
+    if cache is not None:
+        for i, rec in enumerate(records):
+            hit = cache.get_analysis(rec)
+            if hit is not None:
+                cached[i] = hit
+    files = [r.path for i, r in enumerate(records) if i not in cached]
+
+    if workers > 1 and len(files) > 1:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        scans = pool.map(scan_file, files, chunksize=max(1, len(files) // (workers * 4)))
+    else:
+        pool, scans = None, map(scan_file, files)
     try:
-        _ = ollama.show(model)  # comprueba modelo local
-        return True, None
-    except Exception:
-        return False, f"Modelo '{model}' no encontrado localmente. Ejecuta: ollama pull {model}"
+        for i, rec in enumerate(records):
+            fresh = i not in cached
+            cnt, rec.chars, rec.excerpt, rec.sha = next(scans) if fresh else cached[i]
+            if fresh and cache is not None:
+                cache.put_analysis(rec, cnt)
+            if not state["llm_enabled"] or rec.chars < state["min_chars_llm"]:
+                rec.excerpt = ""  # solo el prompt LLM usa el extracto
+            rec.top = index.top(index.add(cnt), top_n)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if cache is not None:
+        evicted = cache.evict_missing({r.path for r in records})
+        cache.close()
+        state["cache_stats"] = {
+            "analysis_hits": len(cached),
+            "analysis_misses": len(files),
+            "evicted": evicted,
+        }
+
+    for rec, kw in zip(records, index.keywords(top_n)):
+        rec.keywords = kw
+    state["global_top"] = index.global_top(top_n)
+    state["vocab_size"] = len(index.terms)
+    return state
 
 
-def _build_prompt(file_name: str, raw_text: str, top_terms: List[Tuple[str, int]]) -> List[Dict[str, str]]:
-    excerpt = raw_text.strip().replace("\n", " ")
-    if len(excerpt) > 1200:
-        excerpt = excerpt[:1200] + "…"
+def _build_prompt(file_name: str, excerpt: str, top_terms: List[Tuple[str, int]]) -> List[Dict[str, str]]:
     bullets = "\n".join([f"- {t}: {f}" for t, f in top_terms])
 
     system_msg = (
@@ -212,85 +532,137 @@ def _build_prompt(file_name: str, raw_text: str, top_terms: List[Tuple[str, int]
     ]
 
 
-def node_llm_refine(state: PipelineState) -> PipelineState:
-    """Genera resumen por archivo con Ollama (si habilitado y elegible por tamaño)."""
-    if not state["llm_enabled"]:
-        return state
-
-    ok, warn = _ollama_ready(state["llm_model"])
-    if not ok:
-        state["warnings"].append(warn or "Ollama no disponible.")
-        state["llm_enabled"] = False
-        return state
-
-    summaries: Dict[str, str] = {}
-    for fp in state["files"]:
-        fname = Path(fp).name
-        raw_text = Path(fp).read_text(encoding="utf-8", errors="ignore")
+def _summarize(client, model: str, temperature: float, messages: List[Dict[str, str]],
+               retries: int, backoff: float = 0.5) -> str:
+    """Una llamada a ollama.chat con reintentos y backoff exponencial.
 
-        # Invocar LLM solo si supera el umbral de longitud
-        if len(raw_text) < state["min_chars_llm"]:
-            summaries[fname] = "(Texto breve: se omite resumen LLM.)"
-            continue
+    La salud del modelo se registra una vez por resumen, tras agotar los reintentos: un solo archivo
+    problemático no suma `retries + 1` fallos seguidos ni corta los resúmenes del resto."""
+    with OLLAMA.track(model):
+        return _chat_retry(client, model, temperature, messages, retries, backoff)
 
-        top = state["counts"].get(fname, [])
-        messages = _build_prompt(fname, raw_text, top)
 
+def _chat_retry(client, model: str, temperature: float, messages: List[Dict[str, str]],
+                retries: int, backoff: float) -> str:
+    last: Optional[Exception] = None
+    for attempt in range(retries + 1):
         try:
-            rsp = ollama.chat(
-                model=state["llm_model"],
-                messages=messages,
-                options={"temperature": state["llm_temperature"]},
-            )
+            t0 = time.perf_counter()
+            rsp = client.chat(model=model, messages=messages, options={"temperature": temperature},
+                              keep_alive=OLLAMA.keep_alive)
+            METRICS.llm(model, time.perf_counter() - t0, rsp, sum(len(m["content"]) for m in messages))
             content = (rsp.get("message", {}) or {}).get("content", "").strip()
             if not content:
                 raise RuntimeError("Respuesta vacía.")
-            summaries[fname] = content
-            time.sleep(0.05)  # respiro corto para modelos locales
+            return content
         except Exception as e:
-            state["warnings"].append(f"Fallo LLM en {fname}: {e}")
-            summaries[fname] = "(No se pudo generar resumen con LLM.)"
-
-    state["llm_summaries"] = summaries
-    return state
+            last = e
+            if attempt < retries:
+                time.sleep(backoff * (2 ** attempt))
+    raise last if last else RuntimeError("Sin intentos.")
 
 
-def node_compile_report(state: PipelineState) -> PipelineState:
-    """Escribe report.md (Markdown) y summary.json (estadísticos)."""
-    out_dir = Path(state["out_dir"])
-    out_dir.mkdir(parents=True, exist_ok=True)
+def node_llm_refine(state: PipelineState) -> PipelineState:
+    """Genera resumen por archivo con Ollama (si habilitado y elegible por tamaño) y
+    vuelca cada archivo al reporte apenas está listo, en el orden de los archivos."""
+    if state["llm_enabled"]:
+        with METRICS.timer("ollama.ready"):
+            # una petición de carga: verifica daemon y modelo y lo deja en memoria con keep_alive
+            ok, warn = OLLAMA.ready(state["llm_model"])
+        if not ok:
+            state["warnings"].append(warn or "Ollama no disponible.")
+            state["llm_enabled"] = False
+
+    writer = ReportWriter(Path(state["out_dir"]), state["warnings"])
+    try:
+        if not state["llm_enabled"]:
+            for rec in state["records"]:
+                writer.add(rec)
+            return state
+        _refine_stream(state, writer)
+    finally:
+        state["report_stats"] = writer.close()
+    return state
 
-    md = ["# Reporte de Frecuencia de Términos\n"]
-    if state["warnings"]:
-        md.append("> **Avisos**:")
-        for w in state["warnings"]:
-            md.append(f"> - {w}")
-        md.append("")
 
-    for fname, pairs in state["counts"].items():
-        md.append(f"## {fname}\n")
-        md.append("| Término | Frecuencia |")
-        md.append("|---|---:|")
-        for term, freq in pairs:
-            md.append(f"| {term} | {freq} |")
-        md.append("")
+def _refine_stream(state: PipelineState, writer: ReportWriter):
+    """Resúmenes concurrentes con ventana acotada; cada uno se escribe en cuanto llega su turno."""
+    client = OLLAMA.client(state["llm_timeout"])
+    model = state["llm_model"]
+    workers = max(1, int(state["llm_workers"]))
+    key = (state["top_n"], state["llm_model"], state["llm_temperature"])
+    cache = ResultCache(state["cache_path"]) if state.get("cache_path") else None
+    hits, misses, skipped = 0, 0, 0
+    # Ventana en orden de archivos: a lo sumo 2*workers resúmenes pendientes o sin escribir
+    window: "deque[Tuple[DocRecord, Union[str, Future]]]" = deque()
+
+    def drain(limit: int):
+        while len(window) > limit:
+            rec, res = window.popleft()
+            if isinstance(res, Future):
+                try:
+                    res = res.result()
+                    if cache is not None:
+                        cache.put_summary(rec, *key, res)
+                except Exception as e:
+                    state["warnings"].append(f"Fallo LLM en {rec.name}: {e}")
+                    res = "(No se pudo generar resumen con LLM.)"
+            writer.add(rec, res)
+
+    # El daemon atiende hasta OLLAMA_NUM_PARALLEL peticiones; el pool acota las que hay en vuelo
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for rec in state["records"]:
+                # Invocar LLM solo si supera el umbral de longitud
+                hit = None
+                if rec.chars < state["min_chars_llm"]:
+                    hit = "(Texto breve: se omite resumen LLM.)"
+                elif cache is not None:
+                    hit = cache.get_summary(rec, *key)
+                    hits += hit is not None
+                if hit is None and not OLLAMA.healthy(model):
+                    # varios fallos seguidos: no se encolan más peticiones hasta que pase el enfriamiento
+                    skipped += 1
+                    hit = "(No se pudo generar resumen con LLM.)"
+                if hit is None:
+                    misses += 1
+                    messages = _build_prompt(rec.name, rec.excerpt, rec.top)
+                    hit = pool.submit(
+                        _summarize, client, model, state["llm_temperature"], messages, state["llm_retries"]
+                    )
+                window.append((rec, hit))
+                drain(2 * workers)
+            drain(0)
+    finally:
+        if skipped:
+            state["warnings"].append(f"Ollama falló varias veces seguidas: se omitieron {skipped} resumen(es).")
+        if cache is not None:
+            cache.close()
+            state["cache_stats"] = {**state.get("cache_stats", {}), "summary_hits": hits, "summary_misses": misses}
 
-        # Adjunta resumen LLM si corresponde
-        if state["llm_enabled"] and state["llm_summaries"].get(fname):
-            md.append("**Resumen LLM (gemma3:1b):**")
-            md.append(state["llm_summaries"][fname])
-            md.append("")
 
-    (out_dir / "report.md").write_text("\n".join(md), encoding="utf-8")
+def node_compile_report(state: PipelineState) -> PipelineState:
+    """Cierra report.md con los avisos posteriores al inicio del volcado y escribe
+    summary.json (estadísticos) a partir de los agregados de ReportWriter."""
+    out_dir = Path(state["out_dir"])
+    stats = state["report_stats"]
+    late = state["warnings"][stats["warnings_written"]:]
+    if late:
+        with open(out_dir / "report.md", "a", encoding="utf-8") as fh:
+            fh.write("> **Avisos**:\n" + "".join(f"> - {w}\n" for w in late))
 
-    # JSON con metadatos del procesamiento
-    unique_vocab = {t for _, pairs in state["counts"].items() for t, _ in pairs}
+    # JSON con metadatos del procesamiento; el detalle por archivo está en files.jsonl
     summary = {
-        "archivos": list(state["counts"].keys()),
+        "archivos": stats["archivos"],
         "top_global": state["global_top"],
-        "unique_vocab_top_terms": len(unique_vocab),
+        "unique_vocab_top_terms": stats["unique_top_terms"],
+        "vocab_size": state.get("vocab_size", 0),
+        "chars": stats["chars"],
+        "files_jsonl": str(out_dir / "files.jsonl"),
         "llm_enabled": state["llm_enabled"],
         "warnings": state["warnings"],
+        "cache": state.get("cache_stats", {}),
+        "ollama": OLLAMA.stats(),
         "params": {
             "top_n": state["top_n"],
             "exts": state["exts"],
@@ -301,6 +673,9 @@ def node_compile_report(state: PipelineState) -> PipelineState:
             "temperature": state["llm_temperature"],
         },
     }
+    if METRICS.enabled:
+        # compile_report aún está en curso: su propio tiempo no alcanza a figurar
+        summary["timing"] = METRICS.summary()
     (out_dir / "summary.json").write_text(
         json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8"
     )
@@ -315,12 +690,15 @@ def node_compile_report(state: PipelineState) -> PipelineState:
 # ===========================
 
 def build_graph():
+    # import diferido: support_rag importa STOP desde aquí sin cargar langgraph
+    from langgraph.graph import StateGraph, END
+
     graph = StateGraph(PipelineState)
 
-    graph.add_node("ingest", node_ingest)
-    graph.add_node("analyze", node_analyze)
-    graph.add_node("llm_refine", node_llm_refine)
-    graph.add_node("compile_report", node_compile_report)
+    graph.add_node("ingest", METRICS.wrap("ingest", node_ingest))
+    graph.add_node("analyze", METRICS.wrap("analyze", node_analyze))
+    graph.add_node("llm_refine", METRICS.wrap("llm_refine", node_llm_refine))
+    graph.add_node("compile_report", METRICS.wrap("compile_report", node_compile_report))
 
     graph.set_entry_point("ingest")
     graph.add_edge("ingest", "analyze")
@@ -344,6 +722,7 @@ def parse_args() -> argparse.Namespace:
     ap.add_argument("--recursive", default="false", choices=["true","false"], help="Búsqueda recursiva.")
     ap.add_argument("--autofill", default="true", choices=["true","false"], help="Autollenar si no hay archivos.")
     ap.add_argument("--min-chars", type=int, default=200, dest="min_chars", help="Invocar LLM si texto >= a este tamaño.")
+    ap.add_argument("--workers", type=int, default=1, help="Procesos para el análisis de frecuencia (1 = serial).")
     # Flags booleanos para LLM
     ap.add_argument("--ollama", dest="ollama", action="store_true", help="Habilita nodo LLM.")
     ap.add_argument("--no-ollama", dest="ollama", action="store_false", help="Deshabilita nodo LLM.")
@@ -351,11 +730,25 @@ def parse_args() -> argparse.Namespace:
     # Modelo y sampling
     ap.add_argument("--model", default="gemma3:1b", help="Modelo Ollama (gemma3:1b por defecto).")
     ap.add_argument("--temp", type=float, default=0.2, help="Temperatura LLM.")
+    ap.add_argument("--cache", dest="cache", action="store_true", help="Usa la cache por archivo en --out (cache.sqlite3).")
+    ap.add_argument("--no-cache", dest="cache", action="store_false", help="Reprocesa todos los archivos.")
+    ap.set_defaults(cache=True)
+    ap.add_argument("--metrics", action="store_true", help="Registra tiempos por nodo y tokens/s (también RAG_METRICS=1).")
+    ap.add_argument("--llm-workers", type=int, default=4, dest="llm_workers", help="Peticiones LLM simultáneas (ajustar a OLLAMA_NUM_PARALLEL).")
+    ap.add_argument("--llm-timeout", type=float, default=120.0, dest="llm_timeout", help="Timeout por petición LLM (s).")
+    ap.add_argument("--llm-retries", type=int, default=2, dest="llm_retries", help="Reintentos por petición LLM fallida.")
+    ap.add_argument("--keep-alive", type=parse_keep_alive, default=OLLAMA.keep_alive, dest="keep_alive",
+                    help="Tiempo que Ollama mantiene el modelo cargado (ej: 30m, 1h, -1 = sin expirar).")
     return ap.parse_args()
 
 
 def main():
     args = parse_args()
+    if args.metrics:
+        METRICS.enabled = True
+    if METRICS.enabled:
+        enable_logging()
+    OLLAMA.keep_alive = args.keep_alive
     app = build_graph()
 
     state: PipelineState = {
@@ -366,13 +759,20 @@ def main():
         "recursive": (args.recursive == "true"),
         "autofill": (args.autofill == "true"),
         "min_chars_llm": int(args.min_chars),
+        "workers": int(args.workers),
         "files": [],
-        "counts": {},
+        "records": [],
         "global_top": [],
+        "vocab_size": 0,
         "llm_enabled": bool(args.ollama),
         "llm_model": str(args.model),
         "llm_temperature": float(args.temp),
-        "llm_summaries": {},
+        "llm_workers": int(args.llm_workers),
+        "llm_timeout": float(args.llm_timeout),
+        "llm_retries": int(args.llm_retries),
+        "cache_path": str(Path(args.out) / "cache.sqlite3") if args.cache else "",
+        "cache_stats": {},
+        "report_stats": {},
         "report_path": "",
         "summary_path": "",
         "warnings": [],
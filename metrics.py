@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentación compartida por support_rag.py y el pipeline de frecuencias
+--------------------------------------------------------------------------
+- Tiempo de pared por nodo de LangGraph y por tramo (embedding, búsqueda, apertura de store, reindex).
+- Llamadas a Ollama: tokens de prompt/salida, tamaño del prompt y tokens/s (eval_count / eval_duration).
+- Salidas: logs estructurados (JSON por línea, logger "rag.metrics"), texto estilo Prometheus
+  (serve(port) o prometheus()) y summary() para incrustar en summary.json.
+
+Desactivado (por defecto, o RAG_METRICS=0) los nodos no se envuelven y timer()/llm() retornan
+de inmediato, así el costo es despreciable.
+"""
+
+from __future__ import annotations
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger("rag.metrics")
+
+
+class _Stat:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count, self.total, self.max = 0, 0.0, 0.0
+
+    def add(self, v: float):
+        self.count += 1
+        self.total += v
+        self.max = v if v > self.max else self.max
+
+
+class Metrics:
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._timings: Dict[str, _Stat] = {}
+        self._llm: Dict[str, Dict[str, float]] = {}
+        self._collectors: List[Callable[[], Dict[str, float]]] = []
+
+    # ---- registro ----
+
+    def observe(self, name: str, seconds: float, **fields: Any):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._timings.setdefault(name, _Stat()).add(seconds)
+        log.info(json.dumps({"event": "timing", "name": name, "seconds": round(seconds, 6), **fields},
+                            ensure_ascii=False, default=str))
+
+    @contextmanager
+    def timer(self, name: str, **fields: Any):
+        if not self.enabled:
+            yield
+            return
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **fields)
+
+    def wrap(self, name: str, fn: Callable) -> Callable:
+        """Envuelve un nodo de LangGraph; si está desactivado devuelve el nodo tal cual."""
+        if not self.enabled:
+            return fn
+
+        @functools.wraps(fn)
+        def node(*args, **kwargs):
+            with self.timer(f"node.{name}"):
+                return fn(*args, **kwargs)
+        return node
+
+    def llm(self, model: str, seconds: float, meta: Optional[Dict[str, Any]] = None, prompt_chars: int = 0):
+        """Registra una llamada de generación. `meta` es la respuesta de Ollama (o response_metadata)."""
+        if not self.enabled:
+            return
+        meta = meta or {}
+        out_toks = int(meta.get("eval_count") or 0)
+        in_toks = int(meta.get("prompt_eval_count") or 0)
+        eval_ns = int(meta.get("eval_duration") or 0)
+        tps = out_toks / (eval_ns / 1e9) if eval_ns else 0.0
+        with self._lock:
+            m = self._llm.setdefault(model, {"calls": 0, "seconds": 0.0, "prompt_tokens": 0, "eval_tokens": 0,
+                                             "eval_seconds": 0.0, "prompt_chars": 0})
+            m["calls"] += 1
+            m["seconds"] += seconds
+            m["prompt_tokens"] += in_toks
+            m["eval_tokens"] += out_toks
+            m["eval_seconds"] += eval_ns / 1e9
+            m["prompt_chars"] += prompt_chars
+        log.info(json.dumps({"event": "llm", "model": model, "seconds": round(seconds, 6),
+                             "prompt_chars": prompt_chars, "prompt_tokens": in_toks, "eval_tokens": out_toks,
+                             "tokens_per_s": round(tps, 2)}))
+
+    def add_collector(self, fn: Callable[[], Dict[str, float]]):
+        """Gauges calculados al exportar (p. ej. profundidad de cola)."""
+        self._collectors.append(fn)
+
+    # ---- exportación ----
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            timings = {k: {"count": s.count, "total_s": round(s.total, 6), "mean_s": round(s.total / s.count, 6),
+                           "max_s": round(s.max, 6)} for k, s in self._timings.items()}
+            llm = {}
+            for model, m in self._llm.items():
+                llm[model] = {**m, "tokens_per_s": (m["eval_tokens"] / m["eval_seconds"]) if m["eval_seconds"] else 0.0}
+        return {"timings": timings, "llm": llm}
+
+    def prometheus(self) -> str:
+        s = self.summary()
+        lines = ["# TYPE rag_seconds summary"]
+        for name, t in s["timings"].items():
+            lines.append(f'rag_seconds_count{{name="{name}"}} {t["count"]}')
+            lines.append(f'rag_seconds_sum{{name="{name}"}} {t["total_s"]}')
+        lines.append("# TYPE rag_seconds_max gauge")
+        for name, t in s["timings"].items():
+            lines.append(f'rag_seconds_max{{name="{name}"}} {t["max_s"]}')
+        lines.append("# TYPE rag_llm_calls_total counter")
+        lines += [f'rag_llm_calls_total{{model="{m}"}} {v["calls"]}' for m, v in s["llm"].items()]
+        lines.append("# TYPE rag_llm_tokens_total counter")
+        for m, v in s["llm"].items():
+            lines.append(f'rag_llm_tokens_total{{model="{m}",kind="prompt"}} {v["prompt_tokens"]}')
+            lines.append(f'rag_llm_tokens_total{{model="{m}",kind="eval"}} {v["eval_tokens"]}')
+        lines.append("# TYPE rag_llm_tokens_per_second gauge")
+        lines += [f'rag_llm_tokens_per_second{{model="{m}"}} {v["tokens_per_s"]:.3f}' for m, v in s["llm"].items()]
+        for fn in self._collectors:
+            try:
+                gauges = fn()
+            except Exception:
+                continue
+            for k, v in gauges.items():
+                lines.append(f"# TYPE rag_{k} gauge")
+                lines.append(f"rag_{k} {v}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> Tuple[str, int]:
+        """Expone GET /metrics en un hilo daemon."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                body = metrics.prometheus().encode("utf-8")
+                self.send_response(200 if self.path.startswith("/metrics") else 404)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        srv = ThreadingHTTPServer((host, port), Handler)
+        srv.daemon_threads = True
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        return srv.server_address[0], srv.server_address[1]
+
+
+METRICS = Metrics(enabled=os.getenv("RAG_METRICS", "0") == "1")
+
+
+def enable_logging(level: int = logging.INFO):
+    """Logs estructurados a stderr (una línea JSON por evento)."""
+    if not log.handlers:
+        h = logging.StreamHandler()
+        h.setFormatter(logging.Formatter("%(message)s"))
+        log.addHandler(h)
+    log.setLevel(level)
+    log.propagate = False
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Cliente Ollama compartido por support_rag.py y el pipeline de frecuencias
+------------------------------------------------------------------------
+- client(timeout): un ollama.Client por timeout y proceso; httpx reutiliza el pool de conexiones.
+- ready(model): una sola petición de carga con keep_alive responde a la vez si el daemon está arriba,
+  si el modelo existe y lo deja en memoria. El resultado se cachea READY_TTL segundos.
+- warm(models): pre-carga en paralelo al arrancar; la primera consulta no paga la carga en frío.
+- track(model): latencia (EWMA) y errores por modelo. Tras `fail_threshold` fallos seguidos el modelo
+  queda caído `cooldown` segundos; healthy() lo informa para desviar consultas (BM25, sin resumen).
+
+keep_alive sale de RAG_KEEP_ALIVE (def. "30m"; "-1" lo fija indefinidamente).
+"""
+
+from __future__ import annotations
+from typing import Any, Dict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import os
+import re
+import sys
+import threading
+import time
+
+
+class _Health:
+    __slots__ = ("calls", "errors", "streak", "ewma", "last_error", "down_until")
+
+    def __init__(self):
+        self.calls, self.errors, self.streak = 0, 0, 0
+        self.ewma, self.last_error, self.down_until = 0.0, "", 0.0
+
+
+_DURATION = re.compile(r"(-?\d+(?:\.\d+)?)(h|m|s)?")
+
+
+def parse_keep_alive(v) -> int:
+    """Segundos para keep_alive: "30m", "1h30m", "90" o "-1" (negativo = sin expirar).
+
+    Siempre entero: OllamaEmbeddings solo acepta segundos."""
+    text = str(v).strip().lower()
+    parts = _DURATION.findall(text)
+    if not parts or "".join(n + u for n, u in parts) != text:
+        raise ValueError(f"keep_alive inválido: {v!r}")
+    return int(sum(float(n) * {"h": 3600, "m": 60}.get(u, 1) for n, u in parts))
+
+
+_WARNED: set = set()
+
+
+def keep_alive_or_default(v, default: str = "30m") -> int:
+    """parse_keep_alive para valores de entorno: uno inválido avisa y usa `default` en vez de abortar."""
+    try:
+        return parse_keep_alive(v)
+    except ValueError as e:
+        if v not in _WARNED:
+            _WARNED.add(v)
+            print(f"[WARN] {e}; se usa {default}", file=sys.stderr)
+        return parse_keep_alive(default)
+
+
+class OllamaManager:
+    def __init__(self, keep_alive: int = 1800, ready_ttl: float = 60.0, fail_threshold: int = 3,
+                 cooldown: float = 30.0, alpha: float = 0.2):
+        self.keep_alive = keep_alive
+        self.ready_ttl, self.fail_threshold, self.cooldown, self.alpha = ready_ttl, fail_threshold, cooldown, alpha
+        self._lock = threading.Lock()
+        self._clients: Dict[Optional[float], Any] = {}
+        self._ready: Dict[str, Tuple[float, bool, Optional[str]]] = {}
+        self._health: Dict[str, _Health] = {}
+
+    # ---- conexión ----
+
+    def client(self, timeout: Optional[float] = None):
+        with self._lock:
+            c = self._clients.get(timeout)
+            if c is None:
+                import ollama
+                c = self._clients[timeout] = ollama.Client(timeout=timeout)
+            return c
+
+    def ready(self, model: str, kind: str = "llm") -> Tuple[bool, Optional[str]]:
+        """(listo, aviso). kind: "llm" (generate) o "embed"."""
+        hit = self._ready.get(model)
+        if hit and time.monotonic() - hit[0] < self.ready_ttl:
+            return hit[1], hit[2]
+        ok, warn = self._load(model, kind)
+        self._ready[model] = (time.monotonic(), ok, warn)
+        return ok, warn
+
+    def _load(self, model: str, kind: str) -> Tuple[bool, Optional[str]]:
+        try:
+            import ollama
+        except ImportError:
+            return False, "Paquete 'ollama' no está instalado (pip install ollama)."
+        try:
+            c = self.client()
+            if kind == "embed":
+                c.embed(model=model, input="warmup", keep_alive=self.keep_alive)
+            else:
+                # prompt vacío: Ollama solo carga el modelo y renueva su keep_alive
+                c.generate(model=model, prompt="", keep_alive=self.keep_alive)
+            return True, None
+        except ollama.ResponseError as e:
+            # la carga en frío no entra en la latencia, pero un fallo sí cuenta para la salud
+            self._record(model, 0.0, e)
+            if e.status_code == 404:
+                return False, f"Modelo '{model}' no encontrado localmente. Ejecuta: ollama pull {model}"
+            return False, f"Ollama rechazó '{model}': {e}"
+        except Exception as e:
+            self._record(model, 0.0, e)
+            return False, f"Ollama no responde: {e}. Asegura que el daemon esté corriendo."
+
+    def warm(self, models: Dict[str, str]) -> Dict[str, Optional[str]]:
+        """Verifica y pre-carga {modelo: kind} en paralelo; aviso por modelo (None si quedó listo)."""
+        if not models:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(models)) as pool:
+            futs = {m: pool.submit(self.ready, m, kind) for m, kind in models.items()}
+        return {m: f.result()[1] for m, f in futs.items()}
+
+    # ---- salud y latencia ----
+
+    def _record(self, model: str, seconds: float, error: Optional[BaseException]):
+        with self._lock:
+            h = self._health.setdefault(model, _Health())
+            h.calls += 1
+            if error is None:
+                h.streak = 0
+                h.ewma = seconds if h.calls == 1 or not h.ewma else (1 - self.alpha) * h.ewma + self.alpha * seconds
+                return
+            h.errors += 1
+            h.streak += 1
+            h.last_error = f"{type(error).__name__}: {error}"[:200]
+            if h.streak >= self.fail_threshold:
+                h.down_until = time.monotonic() + self.cooldown
+                self._ready.pop(model, None)
+
+    @contextmanager
+    def track(self, model: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self._record(model, time.perf_counter() - t0, e)
+            raise
+        self._record(model, time.perf_counter() - t0, None)
+
+    def healthy(self, model: str) -> bool:
+        """False mientras dura el enfriamiento tras fallos seguidos; luego se deja pasar un intento."""
+        h = self._health.get(model)
+        return h is None or time.monotonic() >= h.down_until
+
+    def latency(self, model: str) -> float:
+        h = self._health.get(model)
+        return h.ewma if h else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {m: {"calls": h.calls, "errors": h.errors, "latency_ms": round(h.ewma * 1000, 1),
+                        "healthy": time.monotonic() >= h.down_until, "last_error": h.last_error}
+                    for m, h in self._health.items()}
+
+
+OLLAMA = OllamaManager(keep_alive=keep_alive_or_default(os.getenv("RAG_KEEP_ALIVE", "30m")))
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Cliente del servidor residente de support_rag.py (`serve`)
+----------------------------------------------------------
+Solo biblioteca estándar: `support_rag.py ask` lo usa antes de importar pydantic, LangChain o NumPy,
+así una pregunta contra el servidor ya cargado no paga esas importaciones (~1 s).
+
+Protocolo: una línea JSON {"q": ...} por conexión; la respuesta son líneas JSON [kind, data]
+con los eventos de SupportApp.stream() más ["error", mensaje].
+"""
+
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Iterator, List, Optional, Tuple
+import json
+import os
+import socket
+import sys
+
+DEFAULT_ADDR = os.getenv("SERVER_ADDR", "./rag.sock")
+DEFAULT_QUESTION = "Problema de POS al cerrar caja"
+
+
+def server_address(addr: str) -> Tuple[int, Any]:
+    """"host:puerto" para TCP local, cualquier otro valor es la ruta de un socket Unix."""
+    host, sep, port = addr.rpartition(":")
+    if sep and port.isdigit():
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    return socket.AF_UNIX, str(Path(addr).resolve())
+
+
+def _connect(addr: str, timeout: float = 0.5) -> Optional[socket.socket]:
+    family, target = server_address(addr)
+    if family == socket.AF_UNIX and not Path(target).exists():
+        return None
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(target)
+    except OSError:
+        sock.close()
+        return None
+    sock.settimeout(None)
+    return sock
+
+
+def remote_alive(addr: str) -> bool:
+    sock = _connect(addr)
+    if sock is None:
+        return False
+    sock.close()
+    return True
+
+
+def remote_stream(addr: str, q: str) -> Optional[Iterator[Tuple[str, Any]]]:
+    """Eventos de stream() servidos por `serve`, o None si no hay servidor escuchando."""
+    sock = _connect(addr)
+    if sock is None:
+        return None
+
+    def events():
+        with sock, sock.makefile("rb") as fh:
+            sock.sendall((json.dumps({"q": q}, ensure_ascii=False) + "\n").encode("utf-8"))
+            for line in fh:
+                kind, data = json.loads(line)
+                if kind == "error":
+                    raise RuntimeError(data)
+                yield kind, data
+    return events()
+
+
+def print_stream(events: Iterator[Tuple[str, Any]]) -> None:
+    streamed = False
+    for kind, ev in events:
+        if kind == "sources":
+            print("Fuentes: " + ", ".join(ev), file=sys.stderr, flush=True)
+        elif kind == "token":
+            print(ev, end="", flush=True)
+            streamed = True
+        elif kind == "done" and not streamed:
+            print(ev.get("answer", ""), end="")
+    print()
+
+
+def ask(words: List[str], addr: str = DEFAULT_ADDR) -> bool:
+    """`ask` contra el servidor; False si no hay servidor escuchando (el llamador responde en proceso)."""
+    events = remote_stream(addr, " ".join(words).strip() or DEFAULT_QUESTION)
+    if events is None:
+        return False
+    try:
+        print_stream(events)
+    except RuntimeError as e:
+        raise SystemExit(f"[ERROR] {e}")
+    return True
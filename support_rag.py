@@ -1,15 +1,29 @@
 #!/usr/bin/env python3
 from __future__ import annotations
-import os, sys, json, shutil
+import os, sys, re, csv, json, shutil, sqlite3, tempfile, hashlib, threading, time, atexit, heapq, itertools, math, signal, socket, socketserver, select, struct
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from array import array
+from collections import OrderedDict, deque
 from pathlib import Path
-from typing import List, TypedDict, Dict, Any, Tuple
+from typing import List, TypedDict, Dict, Any, Tuple, Optional, Iterator, Iterable, Callable, Set
+if __name__=="__main__" and len(sys.argv)>=2 and sys.argv[1].lower()=="ask":
+    # con un servidor residente, `ask` responde antes de importar pydantic, LangChain y NumPy
+    import rag_client
+    if rag_client.ask(sys.argv[2:]): sys.exit(0)
 from pydantic import BaseModel
 from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_ollama import OllamaEmbeddings, ChatOllama
-from langchain_chroma import Chroma
-from langgraph.graph import StateGraph, START, END
-import gradio as gr
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from langgraph_ollama_gemma3_pipeline import STOP
+from metrics import METRICS, enable_logging
+from ollama_client import OLLAMA, keep_alive_or_default
+from rag_client import DEFAULT_QUESTION, server_address, remote_alive, remote_stream, print_stream
+# gradio, langchain_chroma, langchain_ollama, el splitter y langgraph se importan donde se usan
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 class Settings(BaseModel):
     OLLAMA_LLM: str = os.getenv("OLLAMA_LLM", "gemma3:1b")
@@ -20,12 +34,400 @@ class Settings(BaseModel):
     CHUNK_OVERLAP: int = int(os.getenv("CHUNK_OVERLAP", 150))
     TOP_K: int = int(os.getenv("TOP_K", 4))
     STAMP_FILE: Path = Path(os.getenv("STAMP_FILE", "./chroma_db/index.stamp")).resolve()
+    EMBED_CACHE_DIR: Path = Path(os.getenv("EMBED_CACHE_DIR", "./emb_cache")).resolve()
+    EMBED_CACHE_MAX: int = int(os.getenv("EMBED_CACHE_MAX", 50000))
+    INDEX_CHECK_SECS: float = float(os.getenv("INDEX_CHECK_SECS", 30))
+    DOCS_WATCH: str = os.getenv("DOCS_WATCH", "auto")
+    WATCH_DEBOUNCE: float = float(os.getenv("WATCH_DEBOUNCE", 1.0))
+    INDEX_BATCH: int = int(os.getenv("INDEX_BATCH", 64))
+    INDEX_WORKERS: int = int(os.getenv("INDEX_WORKERS", 4))
+    EMBED_WORKERS: int = int(os.getenv("EMBED_WORKERS", 4))
+    LLM_WORKERS: int = int(os.getenv("LLM_WORKERS", 2))
+    QUEUE_MAX: int = int(os.getenv("QUEUE_MAX", 32))
+    BATCH_SIZE: int = int(os.getenv("BATCH_SIZE", 32))
+    METRICS_PORT: int = int(os.getenv("METRICS_PORT", 9108))
+    ANSWER_CACHE_MAX: int = int(os.getenv("ANSWER_CACHE_MAX", 256))
+    ANSWER_CACHE_TTL: float = float(os.getenv("ANSWER_CACHE_TTL", 3600))
+    ANSWER_CACHE_SIM: float = float(os.getenv("ANSWER_CACHE_SIM", 0.95))
+    CONTEXT_TOKENS: int = int(os.getenv("CONTEXT_TOKENS", 1200))
+    RETRIEVAL_MODE: str = os.getenv("RETRIEVAL_MODE", "hybrid")
+    EMBED_TIMEOUT: float = float(os.getenv("EMBED_TIMEOUT", 3.0))
+    VECTOR_BACKEND: str = os.getenv("VECTOR_BACKEND", "chroma")
+    SERVER_ADDR: str = os.getenv("SERVER_ADDR", "./rag.sock")
+    KEEP_ALIVE: str = os.getenv("RAG_KEEP_ALIVE", "30m")
+
+class EmbeddingCache:
+    """Cache persistente de embeddings en SQLite (vectors.sqlite3: clave -> vector float32 + último uso, LRU).
+
+    SQLite serializa las escrituras entre procesos: Gradio/serve, `ask` y `batch` comparten EMBED_CACHE_DIR
+    sin pisarse. El último uso de los aciertos se acumula en memoria y se escribe cada `flush_every` s y al salir."""
+    def __init__(self, root: Path, model: str, max_items: int, flush_every: float = 2.0):
+        self.root = root / hashlib.sha1(model.encode()).hexdigest()[:12]
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.model, self.max_items, self.flush_every = model, max_items, flush_every
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(self.root/"vectors.sqlite3"), timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, vec BLOB NOT NULL, used INTEGER NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS vectors_used ON vectors (used)")
+        self.db.commit()
+        self.hits, self.misses = 0, 0
+        self._touched: Dict[str,int] = {}
+        self._last_flush = time.monotonic()
+        atexit.register(self.flush)
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha1(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+    def _write_touched(self) -> None:
+        if self._touched:
+            self.db.executemany("UPDATE vectors SET used=? WHERE key=?", [(t,k) for k,t in self._touched.items()])
+            self._touched.clear()
+        self._last_flush = time.monotonic()
+
+    def flush(self) -> None:
+        with self.lock:
+            if self._touched: self._write_touched(); self.db.commit()
+
+    def get_many(self, keys: List[str]) -> List[Optional[List[float]]]:
+        found: Dict[str,bytes] = {}
+        uniq = list(dict.fromkeys(keys))
+        with self.lock:
+            for i in range(0, len(uniq), 500):
+                part = uniq[i:i+500]
+                found.update(self.db.execute(f"SELECT key, vec FROM vectors WHERE key IN ({','.join('?'*len(part))})", part))
+            now, out = time.time_ns(), []
+            for k in keys:
+                b = found.get(k)
+                if b is None: self.misses += 1; out.append(None); continue
+                self.hits += 1; self._touched[k] = now
+                a = array("f"); a.frombytes(b); out.append(a.tolist())
+            if self._touched and time.monotonic()-self._last_flush >= self.flush_every: self._write_touched(); self.db.commit()
+        return out
+
+    def put_many(self, items: List[Tuple[str,List[float]]]) -> None:
+        if not items: return
+        with self.lock:
+            now = time.time_ns()
+            self.db.executemany("INSERT OR IGNORE INTO vectors VALUES (?,?,?)", [(k, array("f", v).tobytes(), now) for k,v in items])
+            self._write_touched()
+            n = self.db.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+            if n > self.max_items:
+                # se desaloja hasta el 90% para no pagar el DELETE en cada inserción
+                self.db.execute("DELETE FROM vectors WHERE key IN (SELECT key FROM vectors ORDER BY used LIMIT ?)", (n - max(self.max_items*9//10, 1),))
+            self.db.commit()
+
+    def stats(self) -> Dict[str,Any]:
+        total = self.hits + self.misses
+        with self.lock: items = self.db.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+        return {"items": items, "hits": self.hits, "misses": self.misses, "hit_rate": (self.hits/total if total else 0.0)}
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, inner: Embeddings, cache: EmbeddingCache):
+        self.inner, self.cache = inner, cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self.cache.key(t) for t in texts]
+        found = self.cache.get_many(keys)
+        pending: Dict[str,str] = {}
+        for k, t, v in zip(keys, texts, found):
+            if v is None: pending.setdefault(k, t)
+        if pending:
+            got = dict(zip(pending.keys(), self.inner.embed_documents(list(pending.values()))))
+            self.cache.put_many(list(got.items()))
+            found = [v if v is not None else got[k] for k, v in zip(keys, found)]
+        return found
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def stats(self) -> Dict[str,Any]: return self.cache.stats()
+
+class TrackedEmbeddings(Embeddings):
+    """Registra latencia y fallos del modelo de embeddings en OLLAMA (salud para el ruteo a BM25)."""
+    def __init__(self, inner: Embeddings, model: str):
+        self.inner, self.model = inner, model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with OLLAMA.track(self.model): return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with OLLAMA.track(self.model): return self.inner.embed_query(text)
+
+# Mismo vocabulario y stopwords que el pipeline de frecuencias, pero conservando dígitos:
+# códigos de error, modelos de pinpad e IDs de terminal son justo lo que la búsqueda léxica debe encontrar
+LEX_RE = re.compile(r"[0-9A-Za-zÁÉÍÓÚÜÑáéíóúüñ]+", re.UNICODE)
+
+def lex_tokens(text: str) -> List[str]:
+    return [t for t in LEX_RE.findall(text.lower()) if t not in STOP and (len(t)>2 or any(c.isdigit() for c in t))]
+
+# Áreas del formulario Resolver -> términos que las delatan en la ruta, el título o el contenido de un SOP.
+# Sin términos compartidos entre áreas ("ticket", "boleta"): un SOP de impresora de boletas no es de POS
+AREA_TERMS: Dict[str,Tuple[str,...]] = {
+    "POS": ("pos","caja","cajero","venta","ventas","pinpad"),
+    "Inventario": ("inventario","stock","sincroniza","sincronización","conteo"),
+    "Impresora": ("impresora","imprime","imprimir","papel","térmica"),
+    "Etiquetado": ("etiqueta","etiquetas","etiquetado","etiquetadora"),
+    "Red": ("red","switch","router","conexión","offline","cable","internet","wifi"),
+    "Handheld": ("handheld","escáner","escaner","lector","pistola"),
+}
+# casi todo SOP menciona el POS o la red de pasada: solo cuentan en la ruta o el título
+AREA_NAME_ONLY = {"pos","red"}
+SINTOMA_AREAS: Dict[str,Tuple[str,...]] = {"No imprime": ("Impresora",), "Sin conexión": ("Red",), "No sincroniza": ("Red","Inventario")}
+AREA_MIN_HITS = 3  # menciones en el contenido para etiquetar un área que no nombran ni la ruta ni el título
+
+def area_key(area: str) -> str:
+    return "area_" + area.lower()
+
+def doc_title(text: str) -> str:
+    """Encabezados iniciales, antes del primer párrafo (# SOP genérico + ## título real incluidos)."""
+    out = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line: continue
+        if not line.startswith("#"): break
+        out.append(line.lstrip("#"))
+    return " ".join(out)
+
+def doc_tags(rel: str, text: str) -> Dict[str,Any]:
+    """Metadatos para pre-filtrar: `topic` es la carpeta bajo docs (sops, checklists, contingencia...) y
+    `area_<x>` marca el área del SOP. Manda la ruta (carpetas y nombre del archivo); si no nombra ninguna,
+    el título, y si tampoco, el contenido con al menos AREA_MIN_HITS menciones. Entre varias candidatas del
+    título o del contenido queda la dominante (más menciones en el texto)."""
+    parts = Path(rel).parts
+    tf: Dict[str,int] = {}
+    for t in lex_tokens(text): tf[t] = tf.get(t,0)+1
+    hits = {a: sum(tf.get(t,0) for t in terms if t not in AREA_NAME_ONLY) for a, terms in AREA_TERMS.items()}
+    def named(toks: Set[str]) -> List[str]: return [a for a, terms in AREA_TERMS.items() if toks.intersection(terms)]
+    areas = named(set(lex_tokens(" ".join(parts).replace("_"," "))))
+    if not areas:
+        cand = named(set(lex_tokens(doc_title(text)))) or [a for a, n in hits.items() if n >= AREA_MIN_HITS]
+        top = max((hits[a] for a in cand), default=0)
+        areas = [a for a in cand if hits[a]==top]
+    tags: Dict[str,Any] = {"topic": parts[-2] if len(parts)>1 else "general"}
+    for area in AREA_TERMS: tags[area_key(area)] = area in areas
+    return tags
+
+def area_filter(areas: List[str]) -> Optional[Dict[str,Any]]:
+    """Cláusula `where` (sintaxis de Chroma) que exige al menos una de las áreas; None sin áreas."""
+    keys = list(dict.fromkeys(area_key(a) for a in areas if a in AREA_TERMS))
+    if not keys: return None
+    if len(keys)==1: return {keys[0]: True}
+    return {"$or": [{k: True} for k in keys]}
+
+def meta_match(meta: Dict[str,Any], where: Dict[str,Any]) -> bool:
+    """Evalúa el subconjunto de `where` que genera area_filter ($or e igualdades)."""
+    if "$or" in where: return any(meta_match(meta, w) for w in where["$or"])
+    return all(meta.get(k)==v for k,v in where.items())
+
+class LexicalIndex:
+    """Índice invertido BM25 en memoria sobre los mismos chunks de Chroma, persistido como JSON junto a chroma_db."""
+    def __init__(self, path: Path, k1: float = 1.2, b: float = 0.75):
+        self.path, self.k1, self.b = path, k1, b
+        self.docs: Dict[str,Dict[str,Any]] = {}
+        self.postings: Dict[str,Dict[str,int]] = {}
+        self.total_len = 0
+
+    @classmethod
+    def load(cls, path: Path) -> "LexicalIndex":
+        idx = cls(path)
+        try: docs = json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+        except Exception: docs = {}
+        for cid, d in docs.items(): idx._post(cid, d)
+        return idx
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.docs, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(self.path)
+
+    def _post(self, cid: str, d: Dict[str,Any]) -> None:
+        self.docs[cid] = d; self.total_len += d["len"]
+        for t, n in d["tf"].items(): self.postings.setdefault(t, {})[cid] = n
+
+    def add(self, ids: List[str], docs: List[Document]) -> None:
+        for cid, doc in zip(ids, docs):
+            self.remove([cid])
+            toks = lex_tokens(doc.page_content)
+            tf: Dict[str,int] = {}
+            for t in toks: tf[t] = tf.get(t,0)+1
+            self._post(cid, {"text": doc.page_content, "meta": doc.metadata, "tf": tf, "len": len(toks)})
+
+    def remove(self, ids: List[str]) -> None:
+        for cid in ids:
+            d = self.docs.pop(cid, None)
+            if d is None: continue
+            self.total_len -= d["len"]
+            for t in d["tf"]:
+                p = self.postings.get(t, {}); p.pop(cid, None)
+                if not p: self.postings.pop(t, None)
+
+    def document(self, cid: str) -> Document:
+        d = self.docs[cid]
+        return Document(id=cid, page_content=d["text"], metadata=d["meta"])
+
+    def search(self, q: str, k: int, where: Optional[Dict[str,Any]] = None) -> List[Tuple[str,float]]:
+        n = len(self.docs)
+        if not n: return []
+        avg = self.total_len/n or 1.0
+        scores: Dict[str,float] = {}
+        ok: Dict[str,bool] = {}
+        for t in set(lex_tokens(q)):
+            p = self.postings.get(t)
+            if not p: continue
+            idf = math.log(1 + (n-len(p)+0.5)/(len(p)+0.5))
+            for cid, tf in p.items():
+                if where is not None:
+                    if cid not in ok: ok[cid] = meta_match(self.docs[cid]["meta"], where)
+                    if not ok[cid]: continue
+                dl = self.docs[cid]["len"]
+                scores[cid] = scores.get(cid,0.0) + idf*tf*(self.k1+1)/(tf + self.k1*(1-self.b+self.b*dl/avg))
+        return heapq.nlargest(k, scores.items(), key=lambda x: x[1])
+
+def rrf(rankings: List[List[str]], k: int, c: int = 60) -> List[str]:
+    """Reciprocal rank fusion: suma 1/(c+rango) de cada lista."""
+    fused: Dict[str,float] = {}
+    for ranking in rankings:
+        for r, cid in enumerate(ranking):
+            fused[cid] = fused.get(cid,0.0) + 1.0/(c+r+1)
+    return [cid for cid,_ in sorted(fused.items(), key=lambda x: -x[1])[:k]]
+
+class NumpyStore(VectorStore):
+    """Backend vectorial exacto: embeddings normalizados en una matriz float32 (vectors.npy, mmap)
+    + meta.json con IDs, textos y metadatos. Búsqueda por producto punto + argpartition."""
+    def __init__(self, root: Path, embedding: Embeddings):
+        if np is None: raise RuntimeError("VECTOR_BACKEND=numpy requiere numpy (pip install numpy).")
+        self.root, self.emb = root, embedding
+        self.ids: List[str] = []
+        self.docs: List[Tuple[str,Dict[str,Any]]] = []
+        # capacidad >= len(ids); las filas válidas son las primeras len(ids) (ver M)
+        self._buf = np.zeros((0,0), dtype=np.float32)
+        meta, vec = root/"meta.json", root/"vectors.npy"
+        if meta.exists() and vec.exists():
+            d = json.loads(meta.read_text(encoding="utf-8"))
+            self.ids, self.docs = d["ids"], [(t,m) for t,m in d["docs"]]
+            self._buf = np.load(vec, mmap_mode="r")
+        self.pos = {cid:i for i,cid in enumerate(self.ids)}
+        self._rows: Dict[str,Any] = {}  # filas por cláusula `where`, se invalida al modificar
+
+    @property
+    def embeddings(self) -> Embeddings: return self.emb
+
+    @property
+    def M(self) -> Any: return self._buf[:len(self.ids)]
+
+    def _reserve(self, extra: int, dim: int) -> None:
+        """Crece el buffer al doble (no en cada lote): un reindex completo copia O(n) filas en total, no O(n²)."""
+        n, buf = len(self.ids), self._buf
+        if buf.flags.writeable and buf.shape[1:]==(dim,) and n+extra <= len(buf): return
+        grown = np.empty((max(n+extra, 2*len(buf), 256), dim), dtype=np.float32)
+        if n: grown[:n] = buf[:n]
+        self._buf = grown
+
+    @staticmethod
+    def _unit(X) -> Any:
+        X = np.asarray(X, dtype=np.float32)
+        n = np.linalg.norm(X, axis=-1, keepdims=True); n[n==0] = 1.0
+        return X/n
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs) -> List[str]:
+        texts = list(texts)
+        ids = list(ids) if ids else [hashlib.sha1(t.encode()).hexdigest() for t in texts]
+        metadatas = list(metadatas) if metadatas else [{} for _ in texts]
+        if texts: self.add_vectors(ids, self.emb.embed_documents(texts), texts, metadatas)
+        return ids
+
+    def add_vectors(self, ids: List[str], vectors: List[List[float]], texts: List[str], metadatas: List[Dict[str,Any]]) -> None:
+        if not ids: return
+        self.delete([i for i in ids if i in self.pos])
+        V = self._unit(vectors)
+        n = len(self.ids)
+        self._reserve(len(V), V.shape[1])
+        self._buf[n:n+len(V)] = V
+        for cid, t, m in zip(ids, texts, metadatas):
+            self.pos[cid] = len(self.ids); self.ids.append(cid); self.docs.append((t, m))
+        self._rows.clear()
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs) -> Optional[bool]:
+        rows = [self.pos[i] for i in (ids or []) if i in self.pos]
+        if not rows: return False
+        keep = np.ones(len(self.ids), dtype=bool); keep[rows] = False
+        self._buf = np.asarray(self.M)[keep]
+        self.ids = [c for c,k in zip(self.ids, keep) if k]; self.docs = [d for d,k in zip(self.docs, keep) if k]
+        self.pos = {cid:i for i,cid in enumerate(self.ids)}
+        self._rows.clear()
+        return True
+
+    def save(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        np.save(self.root/"vectors.tmp.npy", np.ascontiguousarray(self.M, dtype=np.float32))
+        (self.root/"meta.tmp.json").write_text(json.dumps({"ids": self.ids, "docs": self.docs}, ensure_ascii=False), encoding="utf-8")
+        (self.root/"vectors.tmp.npy").replace(self.root/"vectors.npy")
+        (self.root/"meta.tmp.json").replace(self.root/"meta.json")
+
+    def rows(self, where: Dict[str,Any]) -> Any:
+        key = json.dumps(where, sort_keys=True)
+        if key not in self._rows:
+            self._rows[key] = np.flatnonzero(np.fromiter((meta_match(m, where) for _,m in self.docs), dtype=bool, count=len(self.docs)))
+        return self._rows[key]
+
+    def similarity_search_by_vectors(self, vecs: List[List[float]], k: int = 4, filter: Optional[Dict[str,Any]] = None) -> List[List[Document]]:
+        # con filtro solo se puntúan las filas que lo cumplen
+        rows = self.rows(filter) if filter else None
+        n = len(self.ids) if rows is None else len(rows)
+        if not n or not len(vecs): return [[] for _ in vecs]
+        S = self._unit(vecs) @ (self.M if rows is None else np.asarray(self.M)[rows]).T
+        k = min(k, n)
+        top = np.argpartition(-S, k-1, axis=1)[:, :k] if k<n else np.tile(np.arange(n), (len(S),1))
+        out = []
+        for row, cand in zip(S, top):
+            order = cand[np.argsort(-row[cand])]
+            if rows is not None: order = rows[order]
+            out.append([Document(id=self.ids[i], page_content=self.docs[i][0], metadata=self.docs[i][1]) for i in order])
+        return out
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, filter: Optional[Dict[str,Any]] = None, **kwargs) -> List[Document]:
+        return self.similarity_search_by_vectors([embedding], k, filter)[0]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> List[Document]:
+        return self.similarity_search_by_vector(self.emb.embed_query(query), k, kwargs.get("filter"))
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, root: Optional[Path] = None, **kwargs) -> "NumpyStore":
+        vs = cls(root or Path(tempfile.mkdtemp()), embedding)
+        vs.add_texts(texts, metadatas, ids)
+        return vs
+
+def open_vector_store(s: Settings, emb: Embeddings) -> VectorStore:
+    if s.VECTOR_BACKEND=="numpy": return NumpyStore(s.CHROMA_DIR/"npstore", emb)
+    from langchain_chroma import Chroma
+    return Chroma(collection_name="rag_md", embedding_function=emb, persist_directory=str(s.CHROMA_DIR))
+
+def make_embeddings(s: Settings, timeout: Optional[float] = None, cache: Optional[EmbeddingCache] = None) -> Embeddings:
+    from langchain_ollama import OllamaEmbeddings
+    # timeout del cliente HTTP: la llamada que lo excede falla (y cuenta para la salud) en vez de quedar colgada
+    kw = {"client_kwargs": {"timeout": timeout}} if timeout else {}
+    emb = TrackedEmbeddings(OllamaEmbeddings(model=s.OLLAMA_EMBED, keep_alive=keep_alive_or_default(s.KEEP_ALIVE), **kw), s.OLLAMA_EMBED)
+    if cache is None and s.EMBED_CACHE_MAX > 0: cache = EmbeddingCache(s.EMBED_CACHE_DIR, s.OLLAMA_EMBED, s.EMBED_CACHE_MAX)
+    return emb if cache is None else CachedEmbeddings(emb, cache)
 
 class Indexer:
-    def __init__(self, s: Settings):
+    SCHEMA = 2  # metadatos por chunk: etiquetas area_*/topic y sep_before; el stamp sin "schema" (solo latest_mtime) es la 1
+
+    def __init__(self, s: Settings, emb: Optional[Embeddings] = None):
         self.s = s
-        self.splitter = RecursiveCharacterTextSplitter(chunk_size=s.CHUNK_SIZE, chunk_overlap=s.CHUNK_OVERLAP, add_start_index=True, separators=["\n\n","\n"," ",""])
-        self.emb = OllamaEmbeddings(model=s.OLLAMA_EMBED)
+        self._splitter = None
+        self.emb = emb or make_embeddings(s)
+
+    @property
+    def splitter(self):
+        # solo hace falta al reindexar
+        if self._splitter is None:
+            from langchain_text_splitters import RecursiveCharacterTextSplitter
+            self._splitter = RecursiveCharacterTextSplitter(chunk_size=self.s.CHUNK_SIZE, chunk_overlap=self.s.CHUNK_OVERLAP, add_start_index=True, separators=["\n\n","\n"," ",""])
+        return self._splitter
 
     def _iter_md(self) -> List[Path]:
         if not self.s.DOCS_DIR.exists():
@@ -37,127 +439,787 @@ class Indexer:
         if not files: return 0.0
         return max(p.stat().st_mtime for p in files)
 
-    def read_stamp(self) -> float:
-        if not self.s.STAMP_FILE.exists(): return -1.0
-        try: return float(json.loads(self.s.STAMP_FILE.read_text()).get("latest_mtime",-1.0))
-        except Exception: return -1.0
+    def lexical_path(self) -> Path:
+        return self.s.CHROMA_DIR/"lexical.json"
 
-    def write_stamp(self, m: float) -> None:
+    def read_manifest(self) -> Optional[Dict[str,Dict[str,Any]]]:
+        """Manifiesto por archivo; None si falta o no describe el store activo (hay que reconstruir).
+        Un índice vacío válido (todos los docs eliminados) es {}."""
+        # sin índice léxico los chunks existentes no están cubiertos: se trata como índice antiguo
+        if not self.s.STAMP_FILE.exists() or not self.lexical_path().exists(): return None
+        try: d = json.loads(self.s.STAMP_FILE.read_text())
+        except Exception: return None
+        # un manifiesto de otro backend no describe el store activo
+        if d.get("backend","chroma")!=self.s.VECTOR_BACKEND: return None
+        # chunks sin las etiquetas de área/tema del esquema actual: se reconstruye una vez
+        if d.get("schema",1)!=self.SCHEMA or not isinstance(d.get("files"), dict): return None
+        return dict(d["files"])
+
+    def write_stamp(self, m: float, files: Dict[str,Dict[str,Any]]) -> None:
         self.s.STAMP_FILE.parent.mkdir(parents=True, exist_ok=True)
-        self.s.STAMP_FILE.write_text(json.dumps({"latest_mtime": m}))
+        tmp = self.s.STAMP_FILE.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"latest_mtime": m, "backend": self.s.VECTOR_BACKEND, "schema": self.SCHEMA, "files": files}))
+        tmp.replace(self.s.STAMP_FILE)
+
+    @staticmethod
+    def _digest(f: Path) -> str:
+        h = hashlib.sha1()
+        with f.open("rb") as fh:
+            for b in iter(lambda: fh.read(1<<16), b""): h.update(b)
+        return h.hexdigest()
+
+    def _iter_paths(self, paths: Iterable[str]) -> Iterator[Path]:
+        for rel in paths:
+            p = self.s.DOCS_DIR/rel
+            if p.is_dir(): yield from (f for f in p.rglob("*") if f.is_file() and f.suffix.lower()==".md")
+            elif p.is_file() and p.suffix.lower()==".md": yield p
+
+    def scan(self, manifest: Dict[str,Dict[str,Any]], paths: Optional[Iterable[str]] = None) -> Tuple[List[Tuple[Path,str,str]], List[str], bool]:
+        """Compara DOCS_DIR con el manifiesto: (agregados/modificados, eliminados, hubo cambios de mtime sin cambio de contenido).
+
+        Con `paths` (rutas relativas de archivos o directorios, p. ej. las del watcher) solo se revisa esa parte del árbol."""
+        changed: List[Tuple[Path,str,str]] = []
+        seen, touched = set(), False
+        paths = None if paths is None else sorted(set(paths))
+        for f in (self._iter_md() if paths is None else self._iter_paths(paths)):
+            rel = str(f.relative_to(self.s.DOCS_DIR))
+            if rel in seen: continue  # `paths` puede traer un directorio y archivos dentro de él
+            seen.add(rel)
+            st = f.stat(); e = manifest.get(rel)
+            if e and e.get("mtime")==st.st_mtime and e.get("size")==st.st_size: continue
+            sha = self._digest(f)
+            if e and e.get("sha")==sha:
+                e.update(mtime=st.st_mtime, size=st.st_size); touched = True; continue
+            changed.append((f, rel, sha))
+        if paths is None: removed = [r for r in manifest if r not in seen]
+        else: removed = [r for r in manifest if r not in seen and any(r==p or r.startswith(p.rstrip(os.sep)+os.sep) for p in paths)]
+        return changed, removed, touched
 
     def needs_reindex(self) -> bool:
-        latest = self.latest_mtime()
-        if not self.s.CHROMA_DIR.exists(): return True if latest>0 else False
-        return latest > self.read_stamp()
+        with METRICS.timer("index.check"): return self._needs_reindex()
+
+    def _needs_reindex(self) -> bool:
+        manifest = self.read_manifest()
+        if not self.s.CHROMA_DIR.exists() or manifest is None: return self.latest_mtime()>0
+        changed, removed, touched = self.scan(manifest)
+        return bool(changed or removed or touched)
 
     def _reset_store(self) -> None:
-        if self.s.CHROMA_DIR.exists():
-            shutil.rmtree(self.s.CHROMA_DIR)
+        """Vacía el store activo y el índice léxico. CHROMA_DIR no se borra: Chroma comparte un cliente
+        por ruta dentro del proceso y, con el sqlite eliminado debajo, las escrituras fallan con
+        "readonly database". La colección se elimina por la API y se recrea al abrir el store."""
         self.s.CHROMA_DIR.mkdir(parents=True, exist_ok=True)
+        self.lexical_path().unlink(missing_ok=True)
+        self.s.STAMP_FILE.unlink(missing_ok=True)
+        shutil.rmtree(self.s.CHROMA_DIR/"npstore", ignore_errors=True)
+        if self.s.VECTOR_BACKEND!="numpy": self.store().delete_collection()
+
+    def _load(self, f: Path) -> Optional[Document]:
+        try: text = f.read_text(encoding="utf-8", errors="ignore")
+        except Exception: return None
+        rel = str(f.relative_to(self.s.DOCS_DIR))
+        return Document(page_content=text, metadata={"source_path":str(f),"source_name":f.name,"rel_path":rel,**doc_tags(rel, text)})
+
+    def store(self) -> VectorStore:
+        return open_vector_store(self.s, self.emb)
+
+    def reindex(self, paths: Optional[Iterable[str]] = None) -> bool:
+        """Reindexa lo que cambió (solo bajo `paths` si se indican); True si el índice se modificó."""
+        with METRICS.timer("index.reindex"): return self._reindex(paths)
+
+    def _reindex(self, paths: Optional[Iterable[str]] = None) -> bool:
+        manifest = self.read_manifest()
+        if manifest is None or not self.s.CHROMA_DIR.exists():
+            # Sin manifiesto (índice antiguo o inexistente) no hay IDs de chunks: se reconstruye una vez
+            if self.latest_mtime()<=0: return False
+            self._reset_store(); manifest, paths = {}, None
+        changed, removed, touched = self.scan(manifest, paths)
+        if not (changed or removed or touched): return False
+        vs, lex = self.store(), LexicalIndex.load(self.lexical_path())
+        stale = [i for r in removed+[rel for _,rel,_ in changed] for i in manifest.get(r,{}).get("ids",[])]
+        lex.remove(stale)
+        for r in removed: manifest.pop(r, None)
+        if changed: print(f"[index] {len(changed)} archivo(s) a indexar, {len(removed)} eliminado(s)", file=sys.stderr, flush=True)
+        self._upsert_stream(vs, self._iter_chunks(changed, manifest, lex))
+        # los chunks viejos se borran después de escribir los nuevos (IDs distintos por hash):
+        # una consulta concurrente contra Chroma nunca ve el archivo ausente
+        if stale: vs.delete(ids=stale)
+        lex.save()
+        if isinstance(vs, NumpyStore): vs.save()
+        # el manifiesto se escribe al final: si algo falla, el próximo reindex repite estos archivos (IDs deterministas)
+        self.write_stamp(max((e["mtime"] for e in manifest.values()), default=0.0), manifest)
+        return True
+
+    def _iter_chunks(self, changed: List[Tuple[Path,str,str]], manifest: Dict[str,Dict[str,Any]], lex: LexicalIndex) -> Iterator[Tuple[str,Document]]:
+        for f, rel, sha in changed:
+            doc = self._load(f)
+            if doc is None: manifest.pop(rel, None); continue
+            chunks = self.splitter.split_documents([doc])
+            self._mark_separators(doc.page_content, chunks)
+            ids = [hashlib.sha1(f"{rel}\0{sha}\0{i}".encode()).hexdigest() for i in range(len(chunks))]
+            lex.add(ids, chunks)
+            st = f.stat()
+            manifest[rel] = {"sha": sha, "mtime": st.st_mtime, "size": st.st_size, "ids": ids}
+            yield from zip(ids, chunks)
+
+    @staticmethod
+    def _mark_separators(text: str, chunks: List[Document]) -> None:
+        """sep_before: el texto del archivo entre el chunk anterior y este, si es solo espacio en blanco.
+        El splitter lo recorta; RagAgent._assemble lo repone al unir chunks contiguos."""
+        prev_end = None
+        for c in chunks:
+            start = c.metadata["start_index"]
+            if prev_end is not None and start > prev_end and not text[prev_end:start].strip():
+                c.metadata["sep_before"] = text[prev_end:start]
+            prev_end = start+len(c.page_content) if prev_end is None else max(prev_end, start+len(c.page_content))
+
+    @staticmethod
+    def _upsert(vs: VectorStore, ids: List[str], vecs: List[List[float]], docs: List[Document]) -> None:
+        if isinstance(vs, NumpyStore): vs.add_vectors(ids, vecs, [d.page_content for d in docs], [d.metadata for d in docs])
+        else: vs._collection.upsert(ids=ids, embeddings=vecs, documents=[d.page_content for d in docs], metadatas=[d.metadata for d in docs])
 
-    def load_documents(self) -> List[Document]:
-        docs: List[Document] = []
-        for f in self._iter_md():
-            try: text = f.read_text(encoding="utf-8", errors="ignore")
-            except Exception: continue
-            docs.append(Document(page_content=text, metadata={"source_path":str(f),"source_name":f.name,"rel_path":str(f.relative_to(self.s.DOCS_DIR))}))
-        return docs
-
-    def reindex(self) -> None:
-        raw = self.load_documents()
-        if not raw: return
-        chunks = self.splitter.split_documents(raw)
-        self._reset_store()
-        vs = Chroma(collection_name="rag_md", embedding_function=self.emb, persist_directory=str(self.s.CHROMA_DIR))
-        vs.add_documents(chunks)
-        self.write_stamp(self.latest_mtime())
+    def _upsert_stream(self, vs: VectorStore, items: Iterator[Tuple[str,Document]]) -> int:
+        """Embebe en lotes de INDEX_BATCH con INDEX_WORKERS hilos y escribe cada lote apenas termina
+        (en orden de envío); como máximo 2*INDEX_WORKERS lotes en memoria."""
+        size, workers = max(self.s.INDEX_BATCH,1), max(self.s.INDEX_WORKERS,1)
+        pending: deque = deque()
+        done, t0 = 0, time.monotonic()
+        last = t0
+        def drain(limit: int) -> None:
+            nonlocal done, last
+            while len(pending) > limit:
+                ids, docs, fut = pending.popleft()
+                self._upsert(vs, ids, fut.result(), docs)
+                done += len(ids); now = time.monotonic()
+                if now-last >= 2.0:
+                    print(f"[index] {done} chunks · {done/(now-t0):.1f} chunks/s", file=sys.stderr, flush=True); last = now
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            batch: List[Tuple[str,Document]] = []
+            for item in itertools.chain(items, [None]):
+                if item is not None: batch.append(item)
+                if batch and (item is None or len(batch)>=size):
+                    docs = [d for _,d in batch]
+                    pending.append(([i for i,_ in batch], docs, pool.submit(self.emb.embed_documents, [d.page_content for d in docs])))
+                    batch = []
+                    drain(2*workers)
+            drain(0)
+        if done:
+            el = max(time.monotonic()-t0, 1e-9)
+            print(f"[index] {done} chunks en {el:.1f}s · {done/el:.1f} chunks/s", file=sys.stderr, flush=True)
+        return done
 
     def ensure_index(self) -> None:
         if self.needs_reindex(): self.reindex()
 
-class RAGState(TypedDict):
+class _Inotify:
+    """inotify (Linux) vía ctypes, con un watch por directorio bajo `root`."""
+    MASK = 0x8|0x40|0x80|0x100|0x200|0x400|0x800  # CLOSE_WRITE, MOVED_FROM/TO, CREATE, DELETE, DELETE_SELF, MOVE_SELF
+    ISDIR, OVERFLOW, IGNORED = 0x40000000, 0x4000, 0x8000
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, root: Path):
+        import ctypes
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK|os.O_CLOEXEC)
+        if self.fd < 0: raise OSError(ctypes.get_errno(), "inotify_init1")
+        self.root, self.dirs = root, {}
+        self.add_tree(root)
+
+    def add_tree(self, d: Path) -> None:
+        stack = [str(d)]
+        while stack:
+            cur = stack.pop()
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(cur), self.MASK)
+            if wd < 0: continue
+            self.dirs[wd] = cur
+            try: stack += [e.path for e in os.scandir(cur) if e.is_dir(follow_symlinks=False)]
+            except OSError: pass
+
+    def read(self, timeout: float) -> Tuple[Set[str], bool]:
+        """Rutas relativas afectadas (.md o directorios) y si hay que revisar todo el árbol."""
+        if not select.select([self.fd], [], [], timeout)[0]: return set(), False
+        try: buf = os.read(self.fd, 1<<16)
+        except BlockingIOError: return set(), False
+        out, full, off = set(), False, 0
+        while off < len(buf):
+            wd, mask, _, n = self.EVENT.unpack_from(buf, off)
+            name = buf[off+self.EVENT.size:off+self.EVENT.size+n].rstrip(b"\0").decode("utf-8", "surrogateescape")
+            off += self.EVENT.size+n
+            if mask & self.OVERFLOW: full = True; continue
+            if mask & self.IGNORED: self.dirs.pop(wd, None); continue
+            d = self.dirs.get(wd)
+            if d is None: continue
+            if not name:
+                full |= d==str(self.root); continue  # DELETE_SELF/MOVE_SELF: basta con el evento del padre
+            path = os.path.join(d, name)
+            if mask & self.ISDIR:
+                if mask & (0x80|0x100): self.add_tree(Path(path))
+            elif not name.lower().endswith(".md"): continue
+            out.add(os.path.relpath(path, self.root))
+        return out, full
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+class _Snapshot:
+    """Alternativa portable: compara snapshots de os.scandir (ruta -> mtime_ns, tamaño) de los .md."""
+    def __init__(self, root: Path, stop: threading.Event):
+        self.root, self.stop = root, stop
+        self.state = self.take()
+
+    def take(self) -> Dict[str,Tuple[int,int]]:
+        out, stack = {}, [str(self.root)]
+        while stack:
+            try: it = os.scandir(stack.pop())
+            except OSError: continue
+            with it:
+                for e in it:
+                    try:
+                        if e.is_dir(follow_symlinks=False): stack.append(e.path)
+                        elif e.name.lower().endswith(".md"):
+                            st = e.stat(); out[os.path.relpath(e.path, self.root)] = (st.st_mtime_ns, st.st_size)
+                    except OSError: continue
+        return out
+
+    def read(self, timeout: float) -> Tuple[Set[str], bool]:
+        if self.stop.wait(timeout): return set(), False
+        cur, prev = self.take(), self.state
+        self.state = cur
+        return {r for r in cur.keys()|prev.keys() if cur.get(r)!=prev.get(r)}, False
+
+    def close(self) -> None: pass
+
+class DocsWatcher:
+    """Vigila DOCS_DIR en un hilo daemon y llama on_change(rutas) tras `debounce` s sin eventos nuevos.
+
+    `rutas` son relativas a DOCS_DIR (archivos .md o directorios), o None si hay que revisar todo el
+    árbol (desborde de la cola de inotify). mode: auto (inotify si existe), inotify, poll u off."""
+    def __init__(self, root: Path, on_change: Callable[[Optional[Set[str]]], None], debounce: float, poll_secs: float, mode: str = "auto"):
+        self.root, self.on_change, self.debounce, self.poll_secs = root, on_change, debounce, poll_secs
+        self._stop = threading.Event()
+        self.src: Any = None
+        if mode in ("auto","inotify") and sys.platform.startswith("linux"):
+            try: self.src = _Inotify(root)
+            except (OSError, AttributeError) as e:
+                if mode=="inotify": raise
+                print(f"[WARN] inotify no disponible ({e}); se usa escaneo periódico", file=sys.stderr)
+        if self.src is None and mode!="off": self.src = _Snapshot(root, self._stop)
+        self.backend = {_Inotify: "inotify", _Snapshot: "poll"}.get(type(self.src), "off")
+        self.events, self.batches = 0, 0
+
+    def start(self) -> "DocsWatcher":
+        if self.src is not None: threading.Thread(target=self._run, name="docs-watcher", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        pending: Set[str] = set()
+        full, last = False, 0.0
+        try:
+            while not self._stop.is_set():
+                busy = bool(pending) or full
+                # inotify se despierta con los eventos; el snapshot mira más seguido mientras hay ediciones en curso
+                idle = 1.0 if self.backend=="inotify" else self.poll_secs
+                got, overflow = self.src.read(self.debounce if busy else idle)
+                if got or overflow:
+                    pending |= got; full |= overflow; last = time.monotonic(); self.events += len(got)
+                    continue
+                if busy and time.monotonic()-last >= self.debounce:
+                    batch, pending, full = (None if full else pending), set(), False
+                    self.batches += 1
+                    try: self.on_change(batch)
+                    except Exception as e: print(f"[WARN] Reindexación fallida: {e}", file=sys.stderr)
+        finally:
+            self.src.close()
+
+    def stats(self) -> Dict[str,Any]:
+        return {"backend": self.backend, "events": self.events, "batches": self.batches}
+
+class Saturated(RuntimeError):
+    pass
+
+class PrioritySlots:
+    """Semáforo con espera por prioridad (menor = más urgente; FIFO dentro de la misma prioridad)."""
+    def __init__(self, n: int):
+        self.n, self.free = max(n,1), max(n,1)
+        self.cv = threading.Condition()
+        self.waiting: List[Tuple[int,int]] = []
+        self.seq = itertools.count()
+
+    @contextmanager
+    def slot(self, prio: int, wait: bool = True):
+        """Entrega True con el turno tomado; con wait=False entrega False si no hay uno libre ya."""
+        with self.cv:
+            busy = not wait and (self.free<=0 or bool(self.waiting))
+            if not busy:
+                me = (prio, next(self.seq)); heapq.heappush(self.waiting, me)
+                while not (self.free>0 and self.waiting[0]==me): self.cv.wait()
+                heapq.heappop(self.waiting); self.free -= 1
+                self.cv.notify_all()
+        if busy:
+            yield False
+            return
+        try: yield True
+        finally:
+            with self.cv: self.free += 1; self.cv.notify_all()
+
+    def stats(self) -> Dict[str,int]:
+        with self.cv: return {"running": self.n-self.free, "waiting": len(self.waiting), "slots": self.n}
+
+class AnswerCache:
+    """Cache semántica de respuestas: misma versión de índice + mismos chunks recuperados + pregunta con coseno >= umbral."""
+    def __init__(self, max_items: int, ttl: float, threshold: float):
+        self.max_items, self.ttl, self.threshold = max_items, ttl, threshold
+        self.lock = threading.Lock()
+        self.version = ""
+        self.entries: "OrderedDict[int,Tuple[Tuple[str,...],List[float],str,float]]" = OrderedDict()
+        self.buckets: Dict[Tuple[str,...],List[int]] = {}
+        self.seq = itertools.count()
+        self.hits, self.misses = 0, 0
+
+    @staticmethod
+    def _unit(v: List[float]) -> List[float]:
+        n = math.sqrt(sum(x*x for x in v)) or 1.0
+        return [x/n for x in v]
+
+    def _sync(self, version: str) -> None:
+        if version!=self.version: self.entries.clear(); self.buckets.clear(); self.version = version
+
+    def _drop(self, eid: int) -> None:
+        chunks = self.entries.pop(eid)[0]
+        b = self.buckets.get(chunks, [])
+        if eid in b: b.remove(eid)
+        if not b: self.buckets.pop(chunks, None)
+
+    def get(self, version: str, chunks: Tuple[str,...], qvec: List[float]) -> Optional[str]:
+        if self.max_items<=0: return None
+        u = self._unit(qvec); now = time.monotonic()
+        with self.lock:
+            self._sync(version)
+            for eid in list(self.buckets.get(chunks, [])):
+                _, v, ans, t = self.entries[eid]
+                if now-t > self.ttl: self._drop(eid); continue
+                if sum(a*b for a,b in zip(u,v)) >= self.threshold:
+                    self.entries.move_to_end(eid); self.hits += 1
+                    return ans
+            self.misses += 1
+        return None
+
+    def put(self, version: str, chunks: Tuple[str,...], qvec: List[float], answer: str) -> None:
+        if self.max_items<=0 or not answer: return
+        with self.lock:
+            self._sync(version)
+            while len(self.entries) >= self.max_items: self._drop(next(iter(self.entries)))
+            eid = next(self.seq)
+            self.entries[eid] = (chunks, self._unit(qvec), answer, time.monotonic())
+            self.buckets.setdefault(chunks, []).append(eid)
+
+    def stats(self) -> Dict[str,Any]:
+        total = self.hits + self.misses
+        return {"items": len(self.entries), "hits": self.hits, "misses": self.misses, "hit_rate": (self.hits/total if total else 0.0)}
+
+PRIORITY = {"Tienda detenida": 0, "Caja detenida": 1, "Atención parcial": 2}
+
+class RAGState(TypedDict, total=False):
     question: str
+    priority: int
+    areas: List[str]
     docs: List[Document]
+    qvec: List[float]
     context: str
     answer: str
+    cached: bool
 
 class RagAgent:
-    def __init__(self, s: Settings):
+    def __init__(self, s: Settings, emb: Optional[Embeddings] = None):
         self.s = s
-        self.emb = OllamaEmbeddings(model=s.OLLAMA_EMBED)
-        self.llm = ChatOllama(model=s.OLLAMA_LLM, temperature=0.2)
+        self.emb = emb or make_embeddings(s)
+        from langchain_ollama import ChatOllama
+        self.llm = ChatOllama(model=s.OLLAMA_LLM, temperature=0.2, keep_alive=keep_alive_or_default(s.KEEP_ALIVE))
+        self._lock = threading.Lock()
+        self._vs: Optional[VectorStore] = None
+        self.lexical = LexicalIndex(s.CHROMA_DIR/"lexical.json")
+        # con BM25 de respaldo la pregunta se embebe con un cliente que corta a los EMBED_TIMEOUT s (misma cache)
+        ours = emb is None or isinstance(self.emb, (CachedEmbeddings, TrackedEmbeddings))
+        self.query_emb = make_embeddings(s, s.EMBED_TIMEOUT, getattr(self.emb, "cache", None)) if ours else self.emb
+        self.index_version = ""
+        self._app = None
+        self.answers = AnswerCache(s.ANSWER_CACHE_MAX, s.ANSWER_CACHE_TTL, s.ANSWER_CACHE_SIM)
+        self.embed_slots = PrioritySlots(s.EMBED_WORKERS)
+        self.llm_slots = PrioritySlots(s.LLM_WORKERS)
+
+    def _open_store(self) -> VectorStore:
+        try: self.index_version = str(self.s.STAMP_FILE.stat().st_mtime_ns)
+        except OSError: self.index_version = ""
+        with METRICS.timer("store.open"):
+            self.lexical = LexicalIndex.load(self.s.CHROMA_DIR/"lexical.json")
+            return open_vector_store(self.s, self.emb)
 
-    def retriever(self) -> Chroma:
-        return Chroma(collection_name="rag_md", embedding_function=self.emb, persist_directory=str(self.s.CHROMA_DIR))
+    def retriever(self) -> VectorStore:
+        vs = self._vs
+        if vs is None:
+            with self._lock:
+                if self._vs is None: self._vs = self._open_store()
+                vs = self._vs
+        return vs
+
+    def reload_store(self) -> None:
+        # se abre el nuevo handle antes de publicarlo: las consultas en curso siguen con el anterior
+        self._vs = self._open_store()
 
     def node_retrieve(self, state: RAGState) -> RAGState:
-        r = self.retriever().as_retriever(search_kwargs={"k": self.s.TOP_K})
-        docs = r.invoke(state["question"])
-        return {**state, "docs": docs}
+        vs, q, k, mode = self.retriever(), state["question"], self.s.TOP_K, self.s.RETRIEVAL_MODE
+        where = area_filter(state.get("areas") or [])
+        with METRICS.timer("retrieve.lexical"):
+            lex = self.lexical.search(q, 2*k, where) if mode!="dense" else []
+        qvec: List[float] = []
+        dense: List[Document] = []
+        fallback = mode=="hybrid" and bool(lex)
+        # embeddings caídos (fallos seguidos): mientras dura el enfriamiento ni se intenta, va directo a BM25
+        if mode!="lexical" and not (fallback and not OLLAMA.healthy(self.s.OLLAMA_EMBED)):
+            # con respaldo BM25 no se hace fila: si los EMBED_WORKERS están ocupados se sigue sin vector
+            with self.embed_slots.slot(state.get("priority",1), wait=not fallback) as got:
+                try:
+                    if not got: raise Saturated("embeddings ocupados")
+                    # en modo híbrido, si Ollama tarda o no responde se sigue solo con BM25
+                    with METRICS.timer("retrieve.embed"):
+                        qvec = (self.query_emb if fallback else self.emb).embed_query(q)
+                    with METRICS.timer("retrieve.search", backend=self.s.VECTOR_BACKEND):
+                        dense = self._dense(vs, qvec, 2*k if lex else k, where)
+                except Exception as e:
+                    if not fallback: raise
+                    print(f"[WARN] Embeddings no disponibles ({type(e).__name__}); búsqueda solo léxica.", file=sys.stderr)
+        docs = self._fuse(dense, lex, k)
+        if where is not None and len(docs) < k:
+            with METRICS.timer("retrieve.widen"): docs = self._widen(vs, q, qvec, docs)
+        return {**state, "docs": docs, "qvec": qvec}
+
+    @staticmethod
+    def _dense(vs: VectorStore, qvec: List[float], n: int, where: Optional[Dict[str,Any]]) -> List[Document]:
+        if where is None: return vs.similarity_search_by_vector(qvec, k=n)
+        return vs.similarity_search_by_vector(qvec, k=n, filter=where)
+
+    @staticmethod
+    def _dense_many(vs: VectorStore, qvecs: List[List[float]], n: int, where: Optional[Dict[str,Any]]) -> List[List[Document]]:
+        if isinstance(vs, NumpyStore): return vs.similarity_search_by_vectors(qvecs, k=n, filter=where)
+        # Chroma: una query con todos los vectores en vez de una por pregunta
+        res = vs._collection.query(query_embeddings=qvecs, n_results=n, where=where, include=["documents","metadatas"])
+        return [[Document(id=i, page_content=t, metadata=m or {}) for i, t, m in zip(ids, texts, metas) if t is not None]
+                for ids, texts, metas in zip(res["ids"], res["documents"], res["metadatas"])]
+
+    def _widen(self, vs: VectorStore, q: str, qvec: List[float], docs: List[Document]) -> List[Document]:
+        """Pocos chunks del área pedida: se completa hasta TOP_K con la colección completa."""
+        k, mode = self.s.TOP_K, self.s.RETRIEVAL_MODE
+        lex = self.lexical.search(q, 2*k) if mode!="dense" else []
+        dense = self._dense(vs, qvec, 2*k, None) if qvec else []
+        seen = {d.id for d in docs}
+        return docs + [d for d in self._fuse(dense, lex, k) if d.id not in seen][:k-len(docs)]
+
+    def _fuse(self, dense: List[Document], lex: List[Tuple[str,float]], k: int) -> List[Document]:
+        if not lex: return dense[:k]
+        by_id = {d.id: d for d in dense if d.id}
+        ranked = rrf([[d.id for d in dense if d.id], [cid for cid,_ in lex]], k)
+        return [by_id[cid] if cid in by_id else self.lexical.document(cid) for cid in ranked]
+
+    def retrieve_many(self, questions: List[str], qvecs: List[List[float]], areas: Optional[List[List[str]]] = None) -> List[List[Document]]:
+        """Recuperación por lotes con vectores ya calculados (modo batch): una búsqueda densa
+        en bloque por cada grupo de preguntas que comparten filtro de área."""
+        vs, k, mode = self.retriever(), self.s.TOP_K, self.s.RETRIEVAL_MODE
+        wheres = [area_filter(a) for a in (areas or [[] for _ in questions])]
+        lexs = [self.lexical.search(q, 2*k, w) if mode!="dense" else [] for q, w in zip(questions, wheres)]
+        denses: List[List[Document]] = [[] for _ in questions]
+        if mode!="lexical" and qvecs:
+            groups: Dict[str,List[int]] = {}
+            for i, w in enumerate(wheres): groups.setdefault(json.dumps(w, sort_keys=True), []).append(i)
+            for idxs in groups.values():
+                for i, d in zip(idxs, self._dense_many(vs, [qvecs[i] for i in idxs], 2*k, wheres[idxs[0]])): denses[i] = d
+        out = []
+        for i, (d, l) in enumerate(zip(denses, lexs)):
+            docs = self._fuse(d, l, k)
+            if wheres[i] is not None and len(docs) < k: docs = self._widen(vs, questions[i], qvecs[i] if qvecs else [], docs)
+            out.append(docs)
+        return out
+
+    @staticmethod
+    def _chunk_key(docs: List[Document]) -> Tuple[str,...]:
+        return tuple(sorted(d.id or f"{d.metadata.get('rel_path')}:{d.metadata.get('start_index')}" for d in docs))
+
+    def _assemble(self, docs: List[Document]) -> List[Document]:
+        """Une chunks solapados o contiguos del mismo archivo (start_index, sep_before), descarta casi duplicados
+        y recorta al presupuesto CONTEXT_TOKENS (~4 caracteres por token)."""
+        groups: Dict[str,List[Document]] = {}
+        for d in docs: groups.setdefault(d.metadata.get("rel_path") or d.metadata.get("source_path") or str(id(d)), []).append(d)
+        merged: List[Document] = []
+        for ds in groups.values():
+            if any(d.metadata.get("start_index") is None for d in ds): merged.extend(ds); continue
+            cur: Optional[Document] = None
+            for d in sorted(ds, key=lambda d: d.metadata["start_index"]):
+                start, gap = d.metadata["start_index"], d.metadata.get("sep_before")
+                end = cur.metadata["start_index"]+len(cur.page_content) if cur else -1
+                # contiguos: entre ambos chunks el archivo solo tiene el espacio en blanco que el splitter recortó
+                if cur is not None and (start <= end or (gap is not None and end+len(gap)==start)):
+                    tail = d.page_content[end-start:] if start <= end else gap+d.page_content
+                    cur = Document(page_content=cur.page_content+tail, metadata={**cur.metadata}, id=cur.id)
+                else:
+                    if cur is not None: merged.append(cur)
+                    cur = d
+            if cur is not None: merged.append(cur)
+        seen: List[set] = []
+        out: List[Document] = []
+        budget = self.s.CONTEXT_TOKENS*4 if self.s.CONTEXT_TOKENS>0 else None
+        for d in merged:
+            toks = set(lex_tokens(d.page_content))
+            if toks and any(len(toks & o)/len(toks | o) >= 0.9 for o in seen): continue
+            seen.append(toks)
+            if budget is not None and len(d.page_content) > budget:
+                cut = d.page_content.rfind("\n", 0, budget)
+                if budget >= 200: out.append(Document(page_content=d.page_content[:cut if cut>budget//2 else budget], metadata=d.metadata, id=d.id))
+                break
+            if budget is not None: budget -= len(d.page_content)
+            out.append(d)
+        return out
 
     def _fmt(self, docs: List[Document]) -> str:
         lines=[]
-        for i,d in enumerate(docs,1):
+        for i,d in enumerate(self._assemble(docs),1):
             src = d.metadata.get("rel_path") or d.metadata.get("source_name") or d.metadata.get("source_path")
             lines.append(f"[Doc {i}] ({src})\n{d.page_content}")
         return "\n\n".join(lines)
 
+    def _messages(self, question: str, ctx: str) -> List[Tuple[str,str]]:
+        system = ("Eres un agente de mesa de ayuda para tiendas de FashionPark. Da instrucciones rápidas en listas con acciones de 60–120 segundos y validaciones. Empieza con un resumen en una línea. Si falta un dato, pídele al usuario exactamente ese dato y ofrece una alternativa de verificación. Cierra con listo/no listo y próximos pasos. Incluye al final fuentes entre paréntesis con nombres de archivos.")
+        user = f"Ticket:\n{question}\n\nContexto:\n{ctx}"
+        return [("system",system),("user",user)]
+
     def node_synthesize(self, state: RAGState) -> RAGState:
         ctx = self._fmt(state.get("docs",[])) if state.get("docs") else ""
-        system = ("Eres un agente de mesa de ayuda para tiendas de FashionPark. Da instrucciones rápidas en listas con acciones de 60–120 segundos y validaciones. Empieza con un resumen en una línea. Si falta un dato, pídele al usuario exactamente ese dato y ofrece una alternativa de verificación. Cierra con listo/no listo y próximos pasos. Incluye al final fuentes entre paréntesis con nombres de archivos.")
-        user = f"Ticket:\n{state['question']}\n\nContexto:\n{ctx}"
-        res = self.llm.invoke([("system",system),("user",user)])
+        version, chunks, qvec = self.index_version, self._chunk_key(state.get("docs",[])), state.get("qvec") or []
+        hit = self.answers.get(version, chunks, qvec) if qvec else None
+        if hit is not None: return {**state,"context":ctx,"answer":hit,"cached":True}
+        msgs = self._messages(state["question"], ctx)
+        with self.llm_slots.slot(state.get("priority",1)):
+            t0 = time.perf_counter()
+            with OLLAMA.track(self.s.OLLAMA_LLM): res = self.llm.invoke(msgs)
+            METRICS.llm(self.s.OLLAMA_LLM, time.perf_counter()-t0, getattr(res,"response_metadata",None), sum(len(m) for _,m in msgs))
         ans = res.content if hasattr(res,"content") else str(res)
-        return {**state,"context":ctx,"answer":ans}
+        if qvec: self.answers.put(version, chunks, qvec, ans)
+        return {**state,"context":ctx,"answer":ans,"cached":False}
 
     def graph(self):
+        from langgraph.graph import StateGraph, START, END
         g = StateGraph(RAGState)
-        g.add_node("retrieve", self.node_retrieve)
-        g.add_node("synthesize", self.node_synthesize)
+        g.add_node("retrieve", METRICS.wrap("rag.retrieve", self.node_retrieve))
+        g.add_node("synthesize", METRICS.wrap("rag.synthesize", self.node_synthesize))
         g.add_edge(START,"retrieve")
         g.add_edge("retrieve","synthesize")
         g.add_edge("synthesize",END)
         return g.compile()
 
-    def ask(self, q: str) -> Dict[str,Any]:
-        app = self.graph()
-        fs: RAGState = app.invoke({"question": q})
+    def app(self):
+        if self._app is None:
+            with self._lock:
+                if self._app is None: self._app = self.graph()
+        return self._app
+
+    @staticmethod
+    def _sources(docs: List[Document]) -> List[str]:
         srcs=[]
-        for d in fs.get("docs",[]):
+        for d in docs:
             s = d.metadata.get("rel_path") or d.metadata.get("source_name") or d.metadata.get("source_path")
             if s and s not in srcs: srcs.append(s)
-        return {"answer":fs["answer"],"sources":srcs}
+        return srcs
+
+    def ask(self, q: str, priority: int = 1, areas: Optional[List[str]] = None) -> Dict[str,Any]:
+        fs: RAGState = self.app().invoke({"question": q, "priority": priority, "areas": areas or []})
+        return {"answer":fs["answer"],"sources":self._sources(fs.get("docs",[]))}
+
+    def stream(self, q: str, priority: int = 1, areas: Optional[List[str]] = None) -> Iterator[Tuple[str,Any]]:
+        """Eventos ("sources", [..]) al terminar retrieve, ("token", str) por fragmento del LLM y ("done", {answer, sources})."""
+        srcs: List[str] = []
+        for mode, ev in self.app().stream({"question": q, "priority": priority, "areas": areas or []}, stream_mode=["updates","messages"]):
+            if mode=="messages":
+                chunk, meta = ev
+                if meta.get("langgraph_node")=="synthesize" and chunk.content: yield "token", chunk.content
+            elif "retrieve" in ev:
+                srcs = self._sources(ev["retrieve"].get("docs",[]))
+                yield "sources", srcs
+            elif "synthesize" in ev:
+                yield "done", {"answer":ev["synthesize"].get("answer",""),"sources":srcs}
 
 class SupportApp:
-    def __init__(self):
+    def __init__(self, watch: bool = True):
         self.s = Settings()
-        self.idx = Indexer(self.s)
-        self.agent = RagAgent(self.s)
-        self.idx.ensure_index()
+        OLLAMA.keep_alive = keep_alive_or_default(self.s.KEEP_ALIVE)
+        # carga ambos modelos en paralelo con la revisión del índice; la primera consulta no paga el arranque en frío
+        self._warm = threading.Thread(target=self.warm_models, daemon=True)
+        self._warm.start()
+        self.emb = make_embeddings(self.s)
+        self.idx = Indexer(self.s, self.emb)
+        self.agent = RagAgent(self.s, self.emb)
+        self._index_lock = threading.Lock()
+        self.watcher: Optional[DocsWatcher] = None
+        if watch:
+            # se arranca antes del chequeo inicial para no perder ediciones hechas mientras tanto
+            self.s.DOCS_DIR.mkdir(parents=True, exist_ok=True)
+            self.watcher = DocsWatcher(self.s.DOCS_DIR, self.on_docs_change, self.s.WATCH_DEBOUNCE, self.s.INDEX_CHECK_SECS, self.s.DOCS_WATCH).start()
+        with self._index_lock: self.idx.ensure_index()
+        self._adm = threading.Lock()
+        self._pending, self._rejected = 0, 0
+        METRICS.add_collector(self._gauges)
+
+    def warm_models(self) -> None:
+        for model, warn in OLLAMA.warm({self.s.OLLAMA_LLM: "llm", self.s.OLLAMA_EMBED: "embed"}).items():
+            if warn: print(f"[WARN] {warn}", file=sys.stderr)
+
+    def on_docs_change(self, paths: Optional[Set[str]]) -> None:
+        # corre en el hilo del watcher: las consultas siguen con el store anterior hasta reload_store()
+        with self._index_lock:
+            if self.idx.reindex(paths): self.agent.reload_store()
+
+    @classmethod
+    def form_fields(cls, q: str) -> Dict[str,str]:
+        """Campos clave=valor de una pregunta armada por _build_q (texto de serve/chat). Vale la primera aparición:
+        un "impacto=..." escrito dentro del error o del detalle no pisa el campo del formulario."""
+        out: Dict[str,str] = {}
+        for p in q.split(" | "):
+            k, sep, v = p.partition("=")
+            if sep and k.strip() in cls.FIELDS: out.setdefault(k.strip(), v.strip())
+        return out
+
+    @staticmethod
+    def priority(fields: Dict[str,str]) -> int:
+        return PRIORITY.get(fields.get("impacto","").strip(), 1)
+
+    @staticmethod
+    def areas(fields: Dict[str,str]) -> List[str]:
+        """Áreas para el pre-filtro, desde los campos area y sintoma del formulario (vacío en texto libre)."""
+        names = {a.lower(): a for a in AREA_TERMS}
+        out = [names[fields["area"].strip().lower()]] if fields.get("area","").strip().lower() in names else []
+        return out + [a for a in SINTOMA_AREAS.get(fields.get("sintoma","").strip(), ()) if a not in out]
 
-    def ensure(self): self.idx.ensure_index()
+    @contextmanager
+    def _admitted(self):
+        with self._adm:
+            if self._pending >= self.s.QUEUE_MAX:
+                self._rejected += 1
+                raise Saturated(f"Mesa de ayuda saturada ({self._pending} tickets en curso). Reintenta en unos segundos.")
+            self._pending += 1
+        try: yield
+        finally:
+            with self._adm: self._pending -= 1
 
-    def ask(self, q: str) -> Dict[str,Any]:
-        self.ensure()
-        return self.agent.ask(q)
+    def load_stats(self) -> Dict[str,Any]:
+        with self._adm: adm = {"pending": self._pending, "rejected": self._rejected, "queue_max": self.s.QUEUE_MAX}
+        out = {**adm, "embed": self.agent.embed_slots.stats(), "llm": self.agent.llm_slots.stats(), "answer_cache": self.agent.answers.stats()}
+        if isinstance(self.emb, CachedEmbeddings): out["embedding_cache"] = self.emb.stats()
+        if self.watcher is not None: out["watcher"] = self.watcher.stats()
+        out["ollama"] = OLLAMA.stats()
+        return out
+
+    def _gauges(self) -> Dict[str,float]:
+        st = self.load_stats()
+        return {"pending": st["pending"], "rejected_total": st["rejected"], "embed_waiting": st["embed"]["waiting"], "llm_waiting": st["llm"]["waiting"], "answer_cache_hit_rate": st["answer_cache"]["hit_rate"],
+                "ollama_llm_up": int(OLLAMA.healthy(self.s.OLLAMA_LLM)), "ollama_embed_up": int(OLLAMA.healthy(self.s.OLLAMA_EMBED)),
+                "ollama_llm_latency_ms": OLLAMA.latency(self.s.OLLAMA_LLM)*1000, "ollama_embed_latency_ms": OLLAMA.latency(self.s.OLLAMA_EMBED)*1000}
+
+    def ask(self, q: str, fields: Optional[Dict[str,str]] = None) -> Dict[str,Any]:
+        """`fields`: area/sintoma/impacto del formulario; sin ellos se leen del texto de la pregunta."""
+        f = self.form_fields(q) if fields is None else fields
+        with self._admitted():
+            return self.agent.ask(q, self.priority(f), self.areas(f))
+
+    def stream(self, q: str, fields: Optional[Dict[str,str]] = None) -> Iterator[Tuple[str,Any]]:
+        f = self.form_fields(q) if fields is None else fields
+        with self._admitted():
+            yield from self.agent.stream(q, self.priority(f), self.areas(f))
 
     def _build_q(self, tienda:str, terminal:str, area:str, sintoma:str, error:str, reinicio:str, hora:str, impacto:str, extra:str) -> str:
         parts=[f"tienda={tienda.strip()}" if tienda else "", f"terminal={terminal.strip()}" if terminal else "", f"area={area}", f"sintoma={sintoma}", f"error={error.strip()}" if error else "", f"reinicio={reinicio}", f"hora={hora.strip()}" if hora else "", f"impacto={impacto}", f"extra={extra.strip()}" if extra else ""]
         return " | ".join([p for p in parts if p])
 
+    FIELDS = ("tienda","terminal","area","sintoma","error","reinicio","hora","impacto","extra")
+
+    def _read_tickets(self, path: Path) -> Iterator[Tuple[str,Dict[str,Any]]]:
+        with path.open(encoding="utf-8", newline="") as fh:
+            rows = csv.DictReader(fh) if path.suffix.lower()==".csv" else (json.loads(l) for l in fh if l.strip())
+            for n, r in enumerate(rows, 1): yield str(r.get("id") or n), r
+
+    def _question(self, r: Dict[str,Any]) -> str:
+        if r.get("question"): return str(r["question"])
+        return self._build_q(**{k: str(r.get(k) or "") for k in self.FIELDS})
+
+    def _fields(self, r: Dict[str,Any], q: str) -> Dict[str,str]:
+        # columnas del ticket si las trae; una fila con solo "question" se lee como texto del formulario
+        return {k: str(r[k]) for k in ("area","sintoma","impacto") if r.get(k)} or self.form_fields(q)
+
+    def batch(self, inp: Path, out: Path, size: int) -> Dict[str,Any]:
+        """Responde un CSV/JSONL de tickets escribiendo JSONL incremental. `out` es también el checkpoint:
+        al reanudar se saltan los IDs que ya tienen respuesta (los errores se reintentan)."""
+        done = set()
+        if out.exists():
+            with out.open("rb+") as fh:
+                keep = 0
+                for l in fh:
+                    if not l.endswith(b"\n"): break  # última línea a medio escribir por un corte
+                    keep += len(l)
+                    try: rec = json.loads(l)
+                    except ValueError: continue
+                    if "answer" in rec: done.add(rec["id"])
+                # se corta al final de la última línea completa: la salida sigue siendo JSONL válido
+                fh.truncate(keep)
+        todo = ((i,r) for i,r in self._read_tickets(inp) if i not in done)
+        n, errors, t0 = 0, 0, time.monotonic()
+        with out.open("a", encoding="utf-8") as fh, ThreadPoolExecutor(max_workers=max(self.s.LLM_WORKERS,1)) as pool:
+            while True:
+                chunk = list(itertools.islice(todo, max(size,1)))
+                if not chunk: break
+                qs = [self._question(r) for _,r in chunk]
+                fields = [self._fields(r, q) for (_,r), q in zip(chunk, qs)]
+                qvecs = self.emb.embed_documents(qs) if self.s.RETRIEVAL_MODE!="lexical" else []
+                docs = self.agent.retrieve_many(qs, qvecs, [self.areas(f) for f in fields])
+                futs = {}
+                for (i,_), q, f, d, v in zip(chunk, qs, fields, docs, qvecs or [[] for _ in qs]):
+                    # prioridad por debajo de cualquier ticket interactivo
+                    st = {"question": q, "docs": d, "qvec": v, "priority": 3+self.priority(f)}
+                    futs[pool.submit(self.agent.node_synthesize, st)] = (i, q, d)
+                for f in as_completed(futs):
+                    i, q, d = futs[f]
+                    try: res = f.result(); rec = {"id": i, "question": q, "answer": res["answer"], "sources": RagAgent._sources(d), "cached": res.get("cached", False)}
+                    except Exception as e: rec = {"id": i, "question": q, "error": str(e)}; errors += 1
+                    fh.write(json.dumps(rec, ensure_ascii=False)+"\n"); fh.flush()
+                os.fsync(fh.fileno())
+                n += len(chunk); el = time.monotonic()-t0
+                print(f"[batch] {n} tickets · {n/el:.2f} tickets/s · {errors} errores", file=sys.stderr, flush=True)
+        el = max(time.monotonic()-t0, 1e-9)
+        return {"processed": n, "skipped": len(done), "errors": errors, "seconds": round(el,3), "tickets_per_s": round(n/el,3), "output": str(out)}
+
     def gradio_ui(self):
+        import gradio as gr
+
+        def events(q: str, fields: Optional[Dict[str,str]] = None):
+            try: yield from self.stream(q, fields)
+            except Saturated as e: raise gr.Error(str(e))
+
         def infer_form(tienda, terminal, area, sintoma, error, reinicio, hora, impacto, extra):
             q = self._build_q(tienda, terminal, area, sintoma, error, reinicio, hora, impacto, extra)
-            out = self.ask(q)
-            srcs = "\n".join(f"- {s}" for s in out.get("sources",[]))
-            return out.get("answer",""), srcs
+            ans, srcs = "", ""
+            for kind, ev in events(q, {"area": area, "sintoma": sintoma, "impacto": impacto}):
+                if kind=="sources": srcs = "\n".join(f"- {s}" for s in ev)
+                elif kind=="token": ans += ev
+                elif kind=="done": ans = ev.get("answer","") or ans
+                yield ans, srcs
 
         def infer_chat(chat: List[Tuple[str,str]], msg: str):
-            out = self.ask(msg)
-            ans = out.get("answer","")
-            chat = (chat or []) + [(msg, ans)]
-            return chat, ""
+            chat = (chat or []) + [(msg, "")]
+            ans = ""
+            for kind, ev in events(msg):
+                if kind=="token": ans += ev
+                elif kind=="done": ans = ev.get("answer","") or ans
+                else: continue
+                chat[-1] = (msg, ans)
+                yield chat, ""
 
         areas=["POS","Inventario","Impresora","Etiquetado","Red","Handheld"]
         sintomas=["No imprime","Sin conexión","Lento","Error al cerrar caja","No sincroniza","Pantalla en blanco","Código de error"]
@@ -187,15 +1249,77 @@ class SupportApp:
                 chat_in = gr.Textbox(label="Mensaje")
                 send = gr.Button("Enviar")
                 send.click(infer_chat, inputs=[chat,chat_in], outputs=[chat,chat_in])
-        demo.launch()
+            with gr.Tab("Estado"):
+                stats = gr.JSON(label="Cola y workers")
+                gr.Button("Actualizar").click(lambda: self.load_stats(), outputs=[stats])
+        if METRICS.enabled:
+            host, port = METRICS.serve(self.s.METRICS_PORT)
+            print(f"[OK] Métricas en http://{host}:{port}/metrics", file=sys.stderr)
+        # Gradio no debe limitar ni encolar: sin tope de concurrencia y con hilos de sobra, el ticket
+        # QUEUE_MAX+1 llega a SupportApp._admitted y se rechaza en vez de esperar en la cola de Gradio
+        demo.queue(default_concurrency_limit=None).launch(max_threads=max(40, self.s.QUEUE_MAX+8))
+
+    def serve(self) -> None:
+        """Proceso residente: store, grafo y modelos quedan cargados y `ask` se conecta por SERVER_ADDR.
+
+        Protocolo: una línea JSON {"q": ...} por conexión; la respuesta son líneas JSON [kind, data]
+        con los mismos eventos de stream() más ["error", mensaje]."""
+        family, addr = server_address(self.s.SERVER_ADDR)
+        if remote_alive(self.s.SERVER_ADDR): raise SystemExit(f"[ERROR] Ya hay un servidor escuchando en {addr}")
+        app = self
+        self.agent.retriever(); self.agent.app()
+        self._warm.join()
+
+        class Handler(socketserver.StreamRequestHandler):
+            def send(self, kind: str, data: Any) -> None:
+                self.wfile.write((json.dumps([kind, data], ensure_ascii=False)+"\n").encode("utf-8"))
+
+            def handle(self):
+                try: q = str(json.loads(self.rfile.readline() or b"{}").get("q","")).strip()
+                except ValueError: return self.send("error", "Solicitud inválida")
+                events = app.stream(q)
+                try:
+                    for kind, ev in events: self.send(kind, ev)
+                except (BrokenPipeError, ConnectionResetError): pass
+                except Exception as e: self.send("error", str(e))
+                finally: events.close()
+
+        if family==socket.AF_UNIX:
+            Path(addr).unlink(missing_ok=True)
+            srv = socketserver.ThreadingUnixStreamServer(addr, Handler)
+            atexit.register(lambda: Path(addr).unlink(missing_ok=True))
+        else:
+            srv = socketserver.ThreadingTCPServer(addr, Handler)
+        srv.daemon_threads = True
+        if METRICS.enabled:
+            host, port = METRICS.serve(self.s.METRICS_PORT)
+            print(f"[OK] Métricas en http://{host}:{port}/metrics", file=sys.stderr)
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))  # SIGTERM también limpia el socket (atexit)
+        print(f"[OK] Servidor RAG en {addr}", file=sys.stderr, flush=True)
+        try: srv.serve_forever()
+        except KeyboardInterrupt: pass
+        finally: srv.server_close()
 
 def main():
-    app = SupportApp()
+    if METRICS.enabled: enable_logging()
+    cmd = sys.argv[1].lower() if len(sys.argv)>=2 else "gradio"
+    if cmd=="ask":
+        q=" ".join(sys.argv[2:]).strip() or DEFAULT_QUESTION
+        events = remote_stream(Settings().SERVER_ADDR, q)
+        try: print_stream(events if events is not None else SupportApp(watch=False).stream(q))
+        except RuntimeError as e: raise SystemExit(f"[ERROR] {e}")
+        return
+    if cmd=="batch" and len(sys.argv)<3:
+        raise SystemExit("Uso: support_rag.py batch <tickets.csv|tickets.jsonl> [salida.jsonl]")
+    # batch responde contra un índice fijo; serve y Gradio siguen las ediciones de DOCS_DIR
+    app = SupportApp(watch=cmd!="batch")
     if len(sys.argv)>=2:
-        cmd = sys.argv[1].lower()
-        if cmd=="ask":
-            q=" ".join(sys.argv[2:]).strip() or "Problema de POS al cerrar caja"
-            print(app.ask(q)["answer"]); return
+        if cmd=="serve":
+            app.serve(); return
+        if cmd=="batch":
+            inp = Path(sys.argv[2])
+            out = Path(sys.argv[3]) if len(sys.argv)>=4 else inp.with_suffix(".answers.jsonl")
+            print(json.dumps(app.batch(inp, out, app.s.BATCH_SIZE), ensure_ascii=False)); return
         if cmd=="gradio":
             app.gradio_ui(); return
     app.gradio_ui()
@@ -0,0 +1,60 @@
+import json
+import random
+
+import langgraph_ollama_gemma3_pipeline as pipe
+from ollama_client import OllamaManager
+
+
+class FailingClient:
+    def __init__(self):
+        self.calls = 0
+
+    def chat(self, **kwargs):
+        self.calls += 1
+        raise ConnectionError("caído")
+
+
+def test_summarize_records_one_failure_per_request(monkeypatch):
+    manager = OllamaManager(fail_threshold=3)
+    monkeypatch.setattr(pipe, "OLLAMA", manager)
+    client = FailingClient()
+    msgs = [{"role": "user", "content": "x"}]
+    for _ in range(2):
+        try:
+            pipe._summarize(client, "m", 0.2, msgs, retries=2, backoff=0)
+        except ConnectionError:
+            pass
+    assert client.calls == 6
+    assert manager.stats()["m"]["errors"] == 2
+    assert manager.healthy("m")
+
+
+def run_pipeline(tmp_path, workers):
+    out = tmp_path / f"out{workers}"
+    state = {
+        "input_dir": str(tmp_path / "in"), "out_dir": str(out), "top_n": 5, "exts": [".txt", ".md"],
+        "recursive": True, "autofill": False, "min_chars_llm": 200, "workers": workers,
+        "files": [], "records": [], "global_top": [], "vocab_size": 0, "llm_enabled": False,
+        "llm_model": "m", "llm_temperature": 0.2, "llm_workers": 1, "llm_timeout": 1.0, "llm_retries": 0,
+        "cache_path": "", "cache_stats": {}, "report_stats": {}, "report_path": "", "summary_path": "", "warnings": [],
+    }
+    for node in (pipe.node_ingest, pipe.node_analyze, pipe.node_llm_refine, pipe.node_compile_report):
+        state = node(state)
+    summary = json.loads((out / "summary.json").read_text(encoding="utf-8"))
+    return summary, (out / "files.jsonl").read_text(encoding="utf-8"), (out / "report.md").read_text(encoding="utf-8")
+
+
+def test_parallel_analysis_matches_serial(tmp_path):
+    rng = random.Random(7)
+    words = ["impresora", "caja", "pinpad", "red", "switch", "boleta", "papel", "terminal", "venta", "reinicio"]
+    (tmp_path / "in" / "sub").mkdir(parents=True)
+    for i in range(12):
+        folder = tmp_path / "in" / ("sub" if i % 3 == 0 else "")
+        # empates frecuentes: el desempate debe seguir el orden de primera aparición
+        (folder / f"f{i:02}.txt").write_text(" ".join(rng.choice(words) for _ in range(60)), encoding="utf-8")
+    serial, serial_files, serial_md = run_pipeline(tmp_path, 1)
+    parallel, parallel_files, parallel_md = run_pipeline(tmp_path, 3)
+    assert parallel["top_global"] == serial["top_global"]
+    assert parallel["archivos"] == serial["archivos"]
+    assert parallel_files == serial_files
+    assert parallel_md == serial_md
@@ -0,0 +1,213 @@
+import json
+import threading
+import time
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+import support_rag as sr
+
+
+def make_settings(tmp_path, **kw):
+    (tmp_path / "docs").mkdir(exist_ok=True)
+    return sr.Settings(DOCS_DIR=tmp_path / "docs", CHROMA_DIR=tmp_path / "db", STAMP_FILE=tmp_path / "db" / "index.stamp",
+                       EMBED_CACHE_MAX=0, **kw)
+
+
+def store_count(vs):
+    return len(vs.ids) if isinstance(vs, sr.NumpyStore) else vs._collection.count()
+
+
+@pytest.mark.parametrize("backend", ["chroma", "numpy"])
+def test_reindex_after_emptying_docs(tmp_path, backend):
+    s = make_settings(tmp_path, VECTOR_BACKEND=backend)
+    emb = DeterministicFakeEmbedding(size=8)
+    (s.DOCS_DIR / "a.md").write_text("# Impresora\n\nLa impresora no imprime boletas.", encoding="utf-8")
+    idx = sr.Indexer(s, emb)
+    idx.ensure_index()
+    live = sr.open_vector_store(s, emb)  # handle abierto, como el del agente
+    assert store_count(live) == 1
+
+    (s.DOCS_DIR / "a.md").unlink()
+    assert idx.reindex({"a.md"})
+    assert idx.read_manifest() == {}
+
+    (s.DOCS_DIR / "b.md").write_text("# Red\n\nSwitch sin conexión.", encoding="utf-8")
+    assert idx.reindex({"b.md"})
+    assert list(idx.read_manifest()) == ["b.md"]
+    assert store_count(sr.open_vector_store(s, emb)) == 1
+    assert not idx.needs_reindex()
+
+
+def test_schema_change_rebuilds_with_open_client(tmp_path):
+    s = make_settings(tmp_path)
+    emb = DeterministicFakeEmbedding(size=8)
+    (s.DOCS_DIR / "a.md").write_text("# POS\n\nReinicio de caja.", encoding="utf-8")
+    idx = sr.Indexer(s, emb)
+    idx.ensure_index()
+    sr.open_vector_store(s, emb)
+    d = json.loads(s.STAMP_FILE.read_text())
+    d["schema"] = 1
+    s.STAMP_FILE.write_text(json.dumps(d))
+    assert idx.read_manifest() is None
+    assert idx.reindex()
+    assert store_count(sr.open_vector_store(s, emb)) == 1
+    assert json.loads(s.STAMP_FILE.read_text())["schema"] == sr.Indexer.SCHEMA
+
+
+def test_embedding_cache_shared_between_instances(tmp_path):
+    a = sr.EmbeddingCache(tmp_path, "m", 100)
+    b = sr.EmbeddingCache(tmp_path, "m", 100)
+    ka, kb = a.key("texto A"), b.key("texto B")
+    a.put_many([(ka, [1.0, 0.0])])
+    b.put_many([(kb, [0.0, 1.0])])
+    assert a.get_many([ka, kb]) == [[1.0, 0.0], [0.0, 1.0]]
+    assert b.get_many([kb, ka, "falta"]) == [[0.0, 1.0], [1.0, 0.0], None]
+
+
+def test_embedding_cache_hits_survive_restart(tmp_path):
+    c = sr.EmbeddingCache(tmp_path, "m", 10, flush_every=3600)
+    keys = [c.key(f"t{i}") for i in range(10)]
+    c.put_many([(k, [float(i)]) for i, k in enumerate(keys)])
+    assert c.get_many([keys[0]]) == [[0.0]]
+    c.flush()  # atexit en un proceso real
+    c = sr.EmbeddingCache(tmp_path, "m", 10)
+    c.put_many([(c.key("nuevo"), [99.0])])  # desaloja hasta 9: los menos usados
+    got = c.get_many(keys)
+    assert got[0] == [0.0]
+    assert sum(v is None for v in got) == 2
+
+
+class StubAgent:
+    def __init__(self, fail=()):
+        self.fail, self.asked = set(fail), []
+
+    def retrieve_many(self, qs, qvecs, areas):
+        return [[] for _ in qs]
+
+    def node_synthesize(self, st):
+        self.asked.append(st["question"])
+        if st["question"] in self.fail: raise RuntimeError("timeout")
+        return {"answer": "ok " + st["question"], "cached": False}
+
+
+def batch_app(tmp_path, agent):
+    app = sr.SupportApp.__new__(sr.SupportApp)
+    app.s, app.agent = make_settings(tmp_path, RETRIEVAL_MODE="lexical", LLM_WORKERS=1), agent
+    return app
+
+
+def test_batch_resume_skips_answered_retries_errors_and_truncates(tmp_path):
+    inp = tmp_path / "t.jsonl"
+    inp.write_text("".join(json.dumps({"id": i, "question": f"q{i}"}) + "\n" for i in ("1", "2", "3")), encoding="utf-8")
+    out = tmp_path / "t.answers.jsonl"
+
+    res = batch_app(tmp_path, StubAgent(fail={"q2"})).batch(inp, out, 2)
+    assert (res["processed"], res["errors"]) == (3, 1)
+    # corte a mitad de escribir la línea siguiente
+    with out.open("a", encoding="utf-8") as fh: fh.write('{"id": "3", "answ')
+
+    agent = StubAgent()
+    res = batch_app(tmp_path, agent).batch(inp, out, 2)
+    assert agent.asked == ["q2"]
+    assert (res["processed"], res["skipped"]) == (1, 2)
+    recs = [json.loads(l) for l in out.read_text(encoding="utf-8").splitlines()]
+    assert {r["id"] for r in recs if "answer" in r} == {"1", "2", "3"}
+
+
+def test_batch_without_input_is_a_usage_error(monkeypatch):
+    monkeypatch.setattr(sr.sys, "argv", ["support_rag.py", "batch"])
+    with pytest.raises(SystemExit, match="Uso"):
+        sr.main()
+
+
+class BlockingAgent:
+    def __init__(self):
+        self.release = threading.Event()
+
+    def stream(self, q, priority, areas):
+        self.release.wait(5)
+        yield "done", {"answer": q}
+
+
+def test_admission_rejects_only_tickets_over_queue_max(tmp_path):
+    app = sr.SupportApp.__new__(sr.SupportApp)
+    app.s, app.agent = make_settings(tmp_path, QUEUE_MAX=3), BlockingAgent()
+    app._adm, app._pending, app._rejected = threading.Lock(), 0, 0
+    results, lock = [], threading.Lock()
+
+    def call(i):
+        try: out = list(app.stream(f"q{i}"))[-1][0]
+        except sr.Saturated: out = "saturated"
+        with lock: results.append(out)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(app.s.QUEUE_MAX + 1)]
+    for t in threads: t.start()
+    deadline = time.monotonic() + 5
+    while len(results) < 1 and time.monotonic() < deadline: time.sleep(0.01)
+    app.agent.release.set()
+    for t in threads: t.join(5)
+    assert sorted(results) == ["done"] * app.s.QUEUE_MAX + ["saturated"]
+    assert (app._rejected, app._pending) == (1, 0)
+
+
+class RecordingAgent:
+    def __init__(self):
+        self.calls = []
+
+    def ask(self, q, priority, areas):
+        self.calls.append((priority, areas))
+        return {"answer": q}
+
+
+def form_app(tmp_path):
+    app = sr.SupportApp.__new__(sr.SupportApp)
+    app.s, app.agent = make_settings(tmp_path), RecordingAgent()
+    app._adm, app._pending, app._rejected = threading.Lock(), 0, 0
+    return app
+
+
+def test_free_text_does_not_override_form_fields(tmp_path):
+    app = form_app(tmp_path)
+    form = dict(tienda="T1", terminal="", area="Impresora", sintoma="No imprime", error="papel atascado | area=Red",
+                reinicio="No", hora="", impacto="Atención parcial", extra="urgente, impacto=Tienda detenida")
+    q = app._build_q(**form)
+    app.ask(q, {k: form[k] for k in ("area", "sintoma", "impacto")})
+    app.ask(q)
+    assert app.agent.calls == [(2, ["Impresora"]), (2, ["Impresora"])]
+
+
+def test_slot_without_wait_skips_when_all_busy():
+    slots = sr.PrioritySlots(1)
+    with slots.slot(1) as first:
+        with slots.slot(0, wait=False) as second:
+            assert (first, second) == (True, False)
+    with slots.slot(0, wait=False) as third:
+        assert third and slots.stats()["running"] == 1
+    assert slots.stats()["running"] == 0
+
+
+def areas_of(rel, text):
+    return [k[5:] for k, v in sr.doc_tags(rel, text).items() if k.startswith("area_") and v]
+
+
+def test_doc_tags_path_then_title_then_dominant_content():
+    body = "Revisar la caja y el POS. Reiniciar el switch de la red. Papel, impresora, imprime."
+    assert areas_of("sops/impresora_boleta.md", body) == ["impresora"]
+    assert areas_of("general.md", "# SOP\n## Falla de impresora en el POS\n\n" + body) == ["impresora"]
+    assert areas_of("general.md", "stock e inventario: conteo del inventario en la caja") == ["inventario"]
+    # "pos"/"red" sueltos en el texto no etiquetan
+    assert areas_of("general.md", "pos pos pos red red red") == []
+
+
+def test_assemble_rejoins_contiguous_chunks_with_original_separator(tmp_path):
+    s = make_settings(tmp_path, CHUNK_SIZE=60, CHUNK_OVERLAP=0, CONTEXT_TOKENS=0)
+    text = "# Impresora  \n\nRevisar el papel y la tapa del equipo.  \n\nReiniciar la impresora y probar una boleta."
+    idx = sr.Indexer(s, DeterministicFakeEmbedding(size=8))
+    chunks = idx.splitter.split_documents([sr.Document(page_content=text, metadata={"rel_path": "a.md"})])
+    idx._mark_separators(text, chunks)
+    assert len(chunks) > 1 and all(c.metadata.get("sep_before") == "  \n\n" for c in chunks[1:])
+    agent = sr.RagAgent.__new__(sr.RagAgent)
+    agent.s = s
+    merged = agent._assemble(list(reversed(chunks)))
+    assert [d.page_content for d in merged] == [text]